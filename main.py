@@ -1,8 +1,14 @@
 """SmartHome Mock AI - 主程序入口."""
 
 import asyncio
+import io
+import logging
 import os
+import queue
 import sys
+import threading
+from collections.abc import Awaitable, Callable
+from logging.handlers import QueueHandler, QueueListener
 from typing import Any, NoReturn
 
 from dotenv import load_dotenv
@@ -17,6 +23,75 @@ from smarthome_mock_ai.devices import (
 from smarthome_mock_ai.simulator import HomeSimulator
 from smarthome_mock_ai.voice import VoiceListener, get_default_voice_listener
 
+try:
+    import uvloop
+except ImportError:
+    # uvloop 不支持 Windows,缺失时回退到标准 asyncio 事件循环
+    uvloop = None
+
+# 横幅和帮助文本为静态内容,导入时编码一次
+_BANNER_BYTES = r"""
+╔═══════════════════════════════════════════════════════════╗
+║                                                           ║
+║   🏠 SmartHome Mock AI - 智能家居控制系统                  ║
+║                                                           ║
+║   使用自然语言控制您的虚拟智能家居设备                     ║
+║                                                           ║
+╚═══════════════════════════════════════════════════════════╝
+
+""".encode()
+
+_HELP_BYTES = """
+📖 可用命令:
+  help          - 显示此帮助信息
+  status        - 查看所有设备状态
+  devices       - 列出所有可用设备
+  record / r    - 使用语音输入 (🎤 按下开始录音)
+  preferences   - 显示已学习的用户偏好
+  train         - 重新训练偏好模型
+  reset         - 重置所有设备到初始状态
+  clear         - 清空屏幕
+  exit / quit   - 退出程序
+
+💬 自然语言示例:
+  "打开客厅灯"
+  "太热了"
+  "我要睡觉了"
+  "把温度调到25度"
+  "关闭所有灯"
+  "打开客厅风扇并调到2档"
+  "我要看电视"
+  "回家啦"
+
+""".encode()
+
+log = logging.getLogger("smarthome_mock_ai.cli")
+
+# 设备类型在列表中的显示名称 (按此顺序输出)
+_DEVICE_TYPE_LABELS = {
+    "light": "💡 灯光",
+    "thermostat": "🌡️  温控",
+    "fan": "💨 风扇",
+    "curtain": "🪟 窗帘",
+    "door": "🚪 门锁",
+}
+
+# 清屏控制序列 (POSIX 终端直接写 ANSI 序列,无需派生子进程)
+_CLEAR_SEQ = "\x1b[2J\x1b[H" if os.name == "posix" else None
+
+# print_device_list 的渲染缓存: (设备ID元组, 渲染文本)
+_device_list_cache: tuple[tuple[str, ...], str] | None = None
+
+# 待写入的用户反馈: (action_id, 评分, 纠正指令),由后台写入任务批量落盘;
+# 队列绑定事件循环,由 run_cli 在运行中的循环上创建
+FeedbackQueue = asyncio.Queue[tuple[str, int, str | None]]
+
+# 反馈输入 -> 评分 (+1 正确, -1 错误)
+_FEEDBACK_SCORES = {"y": 1, "yes": 1, "是": 1, "n": -1, "no": -1, "否": -1}
+
+# 反馈批量写入前的聚合等待时间 (秒)
+_FEEDBACK_BATCH_DELAY = 0.05
+
 
 def bootstrap_default_devices(simulator: HomeSimulator) -> None:
     """注册默认设备到模拟器.
@@ -68,81 +143,151 @@ def bootstrap_default_devices(simulator: HomeSimulator) -> None:
     )
 
 
+async def feedback_writer(agent: SmartHomeAgent, feedback_queue: FeedbackQueue) -> NoReturn:
+    """后台反馈写入任务: 从队列取出反馈,聚合后在线程中批量写入数据库.
+
+    Args:
+        agent: AI Agent 实例 (使用其交互日志记录器)
+        feedback_queue: 待写入的反馈队列
+    """
+    while True:
+        batch = [await feedback_queue.get()]
+        await asyncio.sleep(_FEEDBACK_BATCH_DELAY)
+        while not feedback_queue.empty():
+            batch.append(feedback_queue.get_nowait())
+
+        try:
+            # 交互记录在后台写入,先等对应的记录写完,反馈才能找到要更新的行
+            await agent.flush_logs(*(action_id for action_id, _, _ in batch))
+            await asyncio.to_thread(agent.logger.record_feedback_batch, batch)
+        except Exception:
+            log.exception("记录反馈时出错")
+        finally:
+            for _ in batch:
+                feedback_queue.task_done()
+
+
+def _read_stdin_line(prompt: str) -> str:
+    """从标准输入的文件描述符逐字节读取一行 (非终端输入时代替 input()).
+
+    不经过 sys.stdin 的缓冲区及其锁,守护线程阻塞在读取上时解释器仍能正常退出.
+
+    Args:
+        prompt: 输入提示
+
+    Returns:
+        不含换行符的一行文本
+
+    Raises:
+        EOFError: 输入已结束
+    """
+    sys.stdout.write(prompt)
+    sys.stdout.flush()
+    fd = sys.stdin.fileno()
+    data = bytearray()
+    while True:
+        char = os.read(fd, 1)
+        if not char:
+            if not data:
+                raise EOFError
+            break
+        if char == b"\n":
+            break
+        data += char
+    return data.decode(sys.stdin.encoding or "utf-8", errors="replace").rstrip("\r")
+
+
+async def ainput(prompt: str) -> str:
+    """读取一行用户输入,不阻塞事件循环.
+
+    在守护线程中读取输入,等待输入期间后台任务可以继续运行;
+    使用守护线程而非默认线程池,避免 Ctrl+C 退出时等待未完成的读取.
+
+    Args:
+        prompt: 输入提示
+
+    Returns:
+        用户输入的一行文本
+    """
+    loop = asyncio.get_running_loop()
+    future: asyncio.Future[str] = loop.create_future()
+    # 终端输入使用 input() 以保留行编辑; 管道等输入绕过 sys.stdin 的缓冲区锁
+    read = input if sys.stdin.isatty() else _read_stdin_line
+
+    def resolve(value: str | None, error: BaseException | None) -> None:
+        if future.done():
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(value)
+
+    def read_line() -> None:
+        try:
+            value = read(prompt)
+        except BaseException as e:
+            loop.call_soon_threadsafe(resolve, None, e)
+        else:
+            loop.call_soon_threadsafe(resolve, value, None)
+
+    threading.Thread(target=read_line, daemon=True).start()
+    return await future
+
+
+def _write_encoded(data: bytes) -> None:
+    """将预编码的 UTF-8 文本直接写入标准输出的底层缓冲区.
+
+    Args:
+        data: 已编码的文本
+    """
+    sys.stdout.flush()
+    buffer = getattr(sys.stdout, "buffer", None)
+    if buffer is None:
+        sys.stdout.write(data.decode("utf-8"))
+        return
+    buffer.write(data)
+    buffer.flush()
+
+
 def print_banner() -> None:
     """打印欢迎横幅."""
-    banner = r"""
-╔═══════════════════════════════════════════════════════════╗
-║                                                           ║
-║   🏠 SmartHome Mock AI - 智能家居控制系统                  ║
-║                                                           ║
-║   使用自然语言控制您的虚拟智能家居设备                     ║
-║                                                           ║
-╚═══════════════════════════════════════════════════════════╝
-"""
-    print(banner)
+    _write_encoded(_BANNER_BYTES)
 
 
 def print_help() -> None:
     """打印帮助信息."""
-    help_text = """
-📖 可用命令:
-  help          - 显示此帮助信息
-  status        - 查看所有设备状态
-  devices       - 列出所有可用设备
-  record / r    - 使用语音输入 (🎤 按下开始录音)
-  preferences   - 显示已学习的用户偏好
-  train         - 重新训练偏好模型
-  reset         - 重置所有设备到初始状态
-  clear         - 清空屏幕
-  exit / quit   - 退出程序
-
-💬 自然语言示例:
-  "打开客厅灯"
-  "太热了"
-  "我要睡觉了"
-  "把温度调到25度"
-  "关闭所有灯"
-  "打开客厅风扇并调到2档"
-  "我要看电视"
-  "回家啦"
-"""
-    print(help_text)
+    _write_encoded(_HELP_BYTES)
 
 
 def print_device_list(simulator: HomeSimulator) -> None:
     """打印设备列表.
 
+    设备名称和类型在注册后不会改变,渲染结果按设备ID集合缓存.
+
     Args:
         simulator: 模拟器实例
     """
-    print("\n📱 可用设备列表:\n")
-
-    # Get all device metadata
-    all_metadata = simulator.get_all_metadata()
-
-    # Group by device type
-    type_emojis = {
-        "light": "💡 灯光",
-        "thermostat": "🌡️  温控",
-        "fan": "💨 风扇",
-        "curtain": "🪟 窗帘",
-        "door": "🚪 门锁",
-    }
+    global _device_list_cache
+
+    device_ids = tuple(simulator.list_all_devices())
+    if _device_list_cache is None or _device_list_cache[0] != device_ids:
+        # Group by device type
+        grouped: dict[str, list[str]] = {}
+        for device_id, metadata in simulator.get_all_metadata().items():
+            grouped.setdefault(metadata["device_type"], []).append(
+                f"    - {device_id}: {metadata['name']}"
+            )
 
-    grouped: dict[str, list[tuple[str, dict[str, Any]]]] = {}
-    for device_id, metadata in all_metadata.items():
-        device_type = metadata["device_type"]
-        if device_type not in grouped:
-            grouped[device_type] = []
-        grouped[device_type].append((device_id, metadata))
+        # Render by category
+        lines = ["\n📱 可用设备列表:\n"]
+        for device_type, label in _DEVICE_TYPE_LABELS.items():
+            if device_type in grouped:
+                lines.append(f"  {label}")
+                lines.extend(grouped[device_type])
+                lines.append("")
+        _device_list_cache = (device_ids, "\n".join(lines) + "\n")
 
-    # Print by category
-    for device_type, emoji in type_emojis.items():
-        if device_type in grouped:
-            print(f"  {emoji}")
-            for device_id, metadata in grouped[device_type]:
-                print(f"    - {device_id}: {metadata['name']}")
-            print()
+    sys.stdout.write(_device_list_cache[1])
 
 
 def print_device_statuses(simulator: HomeSimulator) -> None:
@@ -153,45 +298,205 @@ def print_device_statuses(simulator: HomeSimulator) -> None:
     """
     statuses = simulator.get_all_statuses()
 
-    print("\n📊 设备状态:\n")
+    parts = ["\n📊 设备状态:\n"]
 
     for device_id, status in statuses.items():
         device_type = status.get("name", device_id)
         location = status.get("room", status.get("location", "未知"))
 
-        print(f"  {device_type} ({location})")
+        parts.append(f"  {device_type} ({location})")
 
         # 根据设备类型显示不同信息
         if "is_on" in status:  # 灯光或风扇
             state = "开启" if status["is_on"] else "关闭"
-            print(f"    状态: {state}")
+            parts.append(f"    状态: {state}")
             if "brightness" in status:
-                print(f"    亮度: {status['brightness']}%")
+                parts.append(f"    亮度: {status['brightness']}%")
             if "color" in status:
-                print(f"    颜色: {status['color']}")
+                parts.append(f"    颜色: {status['color']}")
             if "speed" in status:
-                print(f"    速度: {status['speed']}档")
+                parts.append(f"    速度: {status['speed']}档")
         elif "current_temp" in status:  # 温控器
-            print(f"    当前温度: {status['current_temp']}°C")
-            print(f"    目标温度: {status['target_temp']}°C")
-            print(f"    模式: {status['mode']}")
+            parts.append(f"    当前温度: {status['current_temp']}°C")
+            parts.append(f"    目标温度: {status['target_temp']}°C")
+            parts.append(f"    模式: {status['mode']}")
         elif "position" in status:  # 窗帘
-            print(
-                f"    位置: {status['position']}% ({"打开" if status['position'] > 0 else "关闭"})"
-            )
+            curtain_state = "打开" if status["position"] > 0 else "关闭"
+            parts.append(f"    位置: {status['position']}% ({curtain_state})")
         elif "is_locked" in status:  # 门锁
             lock_state = "已锁定" if status["is_locked"] else "已解锁"
             door_state = "关闭" if status["is_closed"] else "打开"
-            print(f"    锁定: {lock_state}")
-            print(f"    门: {door_state}")
-        print()
+            parts.append(f"    锁定: {lock_state}")
+            parts.append(f"    门: {door_state}")
+        parts.append("")
+
+    sys.stdout.write("\n".join(parts) + "\n")
+
+
+async def stream_agent_response(agent: SmartHomeAgent, user_input: str) -> dict[str, Any]:
+    """调用 Agent 处理请求,文本回复按句流式输出到终端.
+
+    Args:
+        agent: AI Agent 实例
+        user_input: 用户自然语言输入
+
+    Returns:
+        Agent 处理结果字典
+    """
+    streamed = False
+
+    def write_sentence(sentence: str) -> None:
+        nonlocal streamed
+        streamed = True
+        sys.stdout.write(sentence)
+        sys.stdout.flush()
+
+    result = await agent.process(user_input, on_sentence=write_sentence)
+
+    if streamed:
+        sys.stdout.write("\n")
+    # 纯文本回复已流式输出; 工具执行结果和错误信息仍需打印
+    if not streamed or result["actions_taken"] or not result["success"]:
+        print(result["message"])
+    print()
+    return result
+
+
+# ========== 系统命令处理函数 ==========
+# 每个处理函数返回是否继续运行
+
+
+async def _cmd_exit(
+    agent: SmartHomeAgent,
+    simulator: HomeSimulator,
+    voice_listener: VoiceListener | None,
+    feedback_queue: FeedbackQueue | None,
+) -> bool:
+    """退出程序."""
+    return False
+
+
+async def _cmd_help(
+    agent: SmartHomeAgent,
+    simulator: HomeSimulator,
+    voice_listener: VoiceListener | None,
+    feedback_queue: FeedbackQueue | None,
+) -> bool:
+    """显示帮助信息."""
+    print_help()
+    return True
+
+
+async def _cmd_devices(
+    agent: SmartHomeAgent,
+    simulator: HomeSimulator,
+    voice_listener: VoiceListener | None,
+    feedback_queue: FeedbackQueue | None,
+) -> bool:
+    """列出所有设备."""
+    print_device_list(simulator)
+    return True
+
+
+async def _cmd_status(
+    agent: SmartHomeAgent,
+    simulator: HomeSimulator,
+    voice_listener: VoiceListener | None,
+    feedback_queue: FeedbackQueue | None,
+) -> bool:
+    """显示所有设备状态."""
+    print_device_statuses(simulator)
+    return True
+
+
+async def _cmd_reset(
+    agent: SmartHomeAgent,
+    simulator: HomeSimulator,
+    voice_listener: VoiceListener | None,
+    feedback_queue: FeedbackQueue | None,
+) -> bool:
+    """重置所有设备."""
+    simulator.reset_all()
+    print("✓ 所有设备已重置到初始状态\n")
+    return True
+
+
+async def _cmd_clear(
+    agent: SmartHomeAgent,
+    simulator: HomeSimulator,
+    voice_listener: VoiceListener | None,
+    feedback_queue: FeedbackQueue | None,
+) -> bool:
+    """清空屏幕."""
+    if _CLEAR_SEQ is not None:
+        sys.stdout.write(_CLEAR_SEQ)
+        sys.stdout.flush()
+    else:
+        os.system("cls")
+    print_banner()
+    return True
+
+
+async def _cmd_record(
+    agent: SmartHomeAgent,
+    simulator: HomeSimulator,
+    voice_listener: VoiceListener | None,
+    feedback_queue: FeedbackQueue | None,
+) -> bool:
+    """语音输入."""
+    await handle_voice_input(agent, simulator, voice_listener, feedback_queue)
+    return True
+
+
+async def _cmd_preferences(
+    agent: SmartHomeAgent,
+    simulator: HomeSimulator,
+    voice_listener: VoiceListener | None,
+    feedback_queue: FeedbackQueue | None,
+) -> bool:
+    """显示已学习的偏好."""
+    await handle_preferences_command(agent)
+    return True
+
+
+async def _cmd_train(
+    agent: SmartHomeAgent,
+    simulator: HomeSimulator,
+    voice_listener: VoiceListener | None,
+    feedback_queue: FeedbackQueue | None,
+) -> bool:
+    """重新训练偏好模型."""
+    await handle_train_command(agent)
+    return True
+
+
+CommandHandler = Callable[
+    [SmartHomeAgent, HomeSimulator, VoiceListener | None, FeedbackQueue | None], Awaitable[bool]
+]
+
+# 系统命令 (小写) 到处理函数的映射
+COMMAND_TABLE: dict[str, CommandHandler] = {
+    "exit": _cmd_exit,
+    "quit": _cmd_exit,
+    "q": _cmd_exit,
+    "help": _cmd_help,
+    "devices": _cmd_devices,
+    "status": _cmd_status,
+    "reset": _cmd_reset,
+    "clear": _cmd_clear,
+    "record": _cmd_record,
+    "r": _cmd_record,
+    "preferences": _cmd_preferences,
+    "train": _cmd_train,
+}
 
 
 async def process_command(
     user_input: str,
     agent: SmartHomeAgent,
     simulator: HomeSimulator,
-    voice_listener: VoiceListener | None = None
+    voice_listener: VoiceListener | None = None,
+    feedback_queue: FeedbackQueue | None = None,
 ) -> bool:
     """处理用户命令.
 
@@ -200,6 +505,7 @@ async def process_command(
         agent: AI Agent 实例
         simulator: 模拟器实例
         voice_listener: 语音监听器实例
+        feedback_queue: 待写入的反馈队列 (为 None 时不收集反馈)
 
     Returns:
         是否继续运行
@@ -210,94 +516,64 @@ async def process_command(
         return True
 
     # 处理系统命令
-    if user_input.lower() in ["exit", "quit", "q"]:
-        return False
-
-    if user_input.lower() == "help":
-        print_help()
-        return True
-
-    if user_input.lower() == "devices":
-        print_device_list(simulator)
-        return True
-
-    if user_input.lower() == "status":
-        print_device_statuses(simulator)
-        return True
-
-    if user_input.lower() == "reset":
-        simulator.reset_all()
-        print("✓ 所有设备已重置到初始状态\n")
-        return True
-
-    if user_input.lower() == "clear":
-        os.system("clear" if os.name == "posix" else "cls")
-        print_banner()
-        return True
-
-    # Handle voice recording command
-    if user_input.lower() in ["record", "r"]:
-        await handle_voice_input(agent, simulator, voice_listener)
-        return True
-
-    # Handle preferences command
-    if user_input.lower() == "preferences":
-        await handle_preferences_command(agent)
-        return True
-
-    # Handle train command
-    if user_input.lower() == "train":
-        await handle_train_command(agent)
-        return True
+    handler = COMMAND_TABLE.get(user_input.lower())
+    if handler is not None:
+        return await handler(agent, simulator, voice_listener, feedback_queue)
 
     # 使用 AI Agent 处理自然语言命令
     print("\n🤖 正在处理您的请求...\n")
-    result = await agent.process(user_input)
-
-    # Print the result message
-    print(f"{result['message']}\n")
+    result = await stream_agent_response(agent, user_input)
 
     # Collect feedback if action was performed
     if result["success"] and result["action_id"] and result.get("actions_taken"):
-        await collect_feedback(result["action_id"], agent.logger)
+        await collect_feedback(result["action_id"], agent.logger, agent, feedback_queue)
 
     return True
 
 
-async def collect_feedback(action_id: str, logger: Any) -> None:
+async def collect_feedback(
+    action_id: str,
+    logger: Any,
+    agent: SmartHomeAgent | None = None,
+    feedback_queue: FeedbackQueue | None = None,
+) -> None:
     """Collect user feedback for an action.
 
     Args:
         action_id: The ID of the action to get feedback for
         logger: The interaction logger instance
+        agent: Optional agent; negative feedback drops its cached tool calls for the command
+        feedback_queue: Queue drained by feedback_writer; feedback is skipped when None
     """
-    if logger is None:
+    if logger is None or feedback_queue is None:
         return
 
     try:
-        feedback = input("👆 这是否正确? (y/n, 或按 Enter 跳过): ").strip().lower()
+        feedback = (await ainput("👆 这是否正确? (y/n, 或按 Enter 跳过): ")).strip().lower()
 
         if not feedback:
             return  # User skipped feedback
 
-        if feedback in ["y", "yes", "是"]:
+        score = _FEEDBACK_SCORES.get(feedback)
+        if score is None:
+            print("⚠️  无效输入,已跳过反馈。\n")
+        elif score > 0:
             # Positive feedback
-            logger.record_feedback(action_id, 1)
+            feedback_queue.put_nowait((action_id, score, None))
             print("✓ 感谢您的反馈!\n")
-        elif feedback in ["n", "no", "否"]:
-            # Negative feedback - ask for correction
-            correction = input("📝 请描述正确的操作 (或按 Enter 跳过): ").strip()
+        else:
+            # Negative feedback - stop replaying the rejected tool calls, ask for correction
+            if agent is not None:
+                agent.discard_cached_response(action_id)
+            correction = (await ainput("📝 请描述正确的操作 (或按 Enter 跳过): ")).strip()
+            feedback_queue.put_nowait((action_id, score, correction or None))
             if correction:
-                logger.record_feedback(action_id, -1, correction)
                 print("✓ 感谢您的反馈! 我们会学习这个改进。\n")
             else:
-                logger.record_feedback(action_id, -1)
                 print("✓ 反馈已记录。\n")
-        else:
-            print("⚠️  无效输入,已跳过反馈。\n")
 
-    except Exception as e:
-        print(f"⚠️  记录反馈时出错: {e}\n")
+    except Exception:
+        log.exception("记录反馈时出错")
 
 
 async def handle_preferences_command(agent: SmartHomeAgent) -> None:
@@ -331,7 +607,7 @@ async def handle_preferences_command(agent: SmartHomeAgent) -> None:
 
         for context, prefs in contexts.items():
             print(f"    场景: {context}")
-            for pref in prefs[:3]:  # Show top 3
+            for pref in prefs:  # Already limited to the top 3
                 print(f"      - 值: {pref['value']}, 置信度: {pref['confidence']}")
         print()
 
@@ -365,7 +641,8 @@ async def handle_train_command(agent: SmartHomeAgent) -> None:
 async def handle_voice_input(
     agent: SmartHomeAgent,
     simulator: HomeSimulator,
-    voice_listener: VoiceListener | None = None
+    voice_listener: VoiceListener | None = None,
+    feedback_queue: FeedbackQueue | None = None,
 ) -> None:
     """Handle voice input from the user.
 
@@ -373,6 +650,7 @@ async def handle_voice_input(
         agent: AI Agent 实例
         simulator: 模拟器实例
         voice_listener: 语音监听器实例
+        feedback_queue: 待写入的反馈队列 (为 None 时不收集反馈)
     """
     if voice_listener is None:
         print("\n❌ 语音功能未初始化。请确保已安装 pyaudio 库。\n")
@@ -407,17 +685,49 @@ async def handle_voice_input(
 
         # Process the transcribed text through the agent
         print("🤖 正在处理您的请求...\n")
-        result = await agent.process(transcribed_text)
-        print(f"{result['message']}\n")
+        result = await stream_agent_response(agent, transcribed_text)
 
         # Collect feedback if action was performed
         if result["success"] and result["action_id"] and result.get("actions_taken"):
-            await collect_feedback(result["action_id"], agent.logger)
+            await collect_feedback(result["action_id"], agent.logger, agent, feedback_queue)
 
     except RuntimeError as e:
         print(f"\n❌ 语音输入错误: {e}\n")
-    except Exception as e:
-        print(f"\n❌ 发生意外错误: {e}\n")
+    except Exception:
+        log.exception("语音输入处理时发生意外错误")
+
+
+async def shutdown(
+    agent: SmartHomeAgent,
+    voice_listener: VoiceListener | None,
+    background_tasks: list[asyncio.Task[Any]],
+    feedback_queue: FeedbackQueue | None = None,
+) -> None:
+    """退出前写完待处理的反馈,停止后台任务并释放网络连接.
+
+    Args:
+        agent: AI Agent 实例
+        voice_listener: 语音监听器实例 (可能为 None)
+        background_tasks: 启动时创建的后台任务 (连接预热、反馈写入)
+        feedback_queue: 待写入的反馈队列 (可能为 None)
+    """
+    if feedback_queue is not None:
+        await feedback_queue.join()
+    for task in background_tasks:
+        task.cancel()
+    await agent.aclose()
+    if voice_listener is not None:
+        await voice_listener.aclose()
+
+
+def _init_voice_listener() -> tuple[VoiceListener, bool]:
+    """创建语音监听器并检测麦克风 (枚举音频设备较慢,在线程中调用).
+
+    Returns:
+        (语音监听器, 麦克风是否可用)
+    """
+    voice_listener = get_default_voice_listener()
+    return voice_listener, voice_listener.is_available()
 
 
 async def run_cli() -> NoReturn:
@@ -435,45 +745,88 @@ async def run_cli() -> NoReturn:
     # 初始化 Agent
     agent = SmartHomeAgent(simulator)
 
-    # Train preferences on startup
+    # 在用户阅读欢迎信息期间预热 LLM 连接
+    background_tasks = [asyncio.create_task(agent.warmup())]
+    feedback_queue: FeedbackQueue | None = None
+    if agent.logger is not None:
+        feedback_queue = asyncio.Queue()
+        background_tasks.append(asyncio.create_task(feedback_writer(agent, feedback_queue)))
+
+    # 偏好训练与语音初始化互不依赖,在线程中并发执行
     print("📚 正在加载您的偏好设置...")
-    stats = agent.train_preferences()
+    stats, voice_init = await asyncio.gather(
+        asyncio.to_thread(agent.train_preferences),
+        asyncio.to_thread(_init_voice_listener),
+        return_exceptions=True,
+    )
+
+    if isinstance(stats, Exception):
+        stats = {"error": str(stats)}
     if "error" not in stats and stats.get("total_interactions", 0) > 0:
         print(f"✓ 已加载 {stats['total_interactions']} 条历史交互记录")
         if stats.get("preferences_learned", 0) > 0:
             print(f"✓ 已学习 {stats['preferences_learned']} 个用户偏好")
     print()
 
-    # Initialize voice listener
     voice_listener = None
-    try:
-        voice_listener = get_default_voice_listener()
-        if voice_listener.is_available():
+    if isinstance(voice_init, Exception):
+        print(f"⚠️  语音功能初始化失败: {voice_init}")
+    else:
+        voice_listener, voice_available = voice_init
+        if voice_available:
             print("✅ 语音输入已就绪! (输入 'r' 或 'record' 开始录音)")
         else:
             print("⚠️  未检测到麦克风,语音输入功能不可用")
-    except Exception as e:
-        print(f"⚠️  语音功能初始化失败: {e}")
 
     print("\n✅ 系统已就绪! 输入您的命令或自然语言指令 (输入 'help' 查看帮助)\n")
 
-    while True:
-        try:
-            user_input = input("🏠 您的需求 > ").strip()
-            should_continue = await process_command(user_input, agent, simulator, voice_listener)
-            if not should_continue:
-                print("\n👋 再见! 感谢使用 SmartHome Mock AI\n")
-                sys.exit(0)
-        except KeyboardInterrupt:
-            print("\n\n👋 程序已中断,再见!\n")
-            sys.exit(0)
-        except Exception as e:
-            print(f"\n❌ 发生错误: {e}\n")
+    try:
+        while True:
+            try:
+                user_input = (await ainput("🏠 您的需求 > ")).strip()
+                if not await process_command(
+                    user_input, agent, simulator, voice_listener, feedback_queue
+                ):
+                    break
+            except EOFError:
+                # 输入流结束 (如管道输入读完或 Ctrl+D),按正常退出处理
+                break
+            except Exception:
+                log.exception("处理命令时发生错误")
+    finally:
+        # Ctrl+C 时 asyncio.run 会取消本任务,正常退出与中断都在这里写完反馈并释放连接
+        await shutdown(agent, voice_listener, background_tasks, feedback_queue)
+
+    print("\n👋 再见! 感谢使用 SmartHome Mock AI\n")
+    sys.exit(0)
+
+
+def start_log_listener() -> QueueListener:
+    """将 smarthome_mock_ai 的日志经队列交给后台线程输出,异常路径不阻塞事件循环.
+
+    Returns:
+        已启动的 QueueListener,退出前需调用 stop()
+    """
+    log_queue: queue.SimpleQueue[logging.LogRecord] = queue.SimpleQueue()
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("\n❌ %(message)s"))
+
+    package_logger = logging.getLogger("smarthome_mock_ai")
+    package_logger.addHandler(QueueHandler(log_queue))
+    package_logger.propagate = False
+
+    listener = QueueListener(log_queue, handler)
+    listener.start()
+    return listener
 
 
 def main() -> None:
     """主函数入口."""
-    # 加载环境变量
+    # 固定 UTF-8 行缓冲输出,避免中文与 emoji 受系统 locale 影响
+    if isinstance(sys.stdout, io.TextIOWrapper):
+        sys.stdout.reconfigure(encoding="utf-8", line_buffering=True, write_through=False)
+
+    # 加载环境变量 (不会覆盖环境中已有的变量)
     load_dotenv()
 
     # 检查 API Key
@@ -483,12 +836,18 @@ def main() -> None:
         print("   AI 功能将无法使用,请在 .env 文件中设置 API Key")
         print("   提示: 复制 .env.example 为 .env 并填入您的 API Key\n")
 
-    # 运行异步主循环
+    log_listener = start_log_listener()
     try:
-        asyncio.run(run_cli())
+        # 运行异步主循环 (可用时使用 uvloop 降低调度开销; uvloop.install 在 3.12+ 已弃用)
+        if uvloop is not None:
+            uvloop.run(run_cli())
+        else:
+            asyncio.run(run_cli())
     except KeyboardInterrupt:
         print("\n\n👋 程序已退出,再见!\n")
         sys.exit(0)
+    finally:
+        log_listener.stop()
 
 
 if __name__ == "__main__":
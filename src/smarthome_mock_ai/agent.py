@@ -1,15 +1,385 @@
 """AI Agent - 使用 LLM 和 Function Calling 控制智能家居."""
 
-import json
+import asyncio
+import atexit
+import concurrent.futures
+import functools
+import itertools
+import logging
 import os
+import re
+import sqlite3
+import threading
+import time
+import traceback
+from collections import OrderedDict
+from collections.abc import AsyncIterator, Callable
 from datetime import datetime
 from typing import Any
 
 import httpx
+import orjson
+
+try:
+    import h2
+except ImportError:
+    # 未安装 h2 (httpx[http2]) 时回退到 HTTP/1.1 连接池
+    h2 = None
 
 from smarthome_mock_ai.interaction_logger import InteractionLogger, get_interaction_logger
 from smarthome_mock_ai.learning import PreferenceModel, get_preference_model
 
+log = logging.getLogger(__name__)
+
+# 流式响应中工具调用参数接收完整时的回调: (序号, 工具名称, 参数)
+ToolCallCallback = Callable[[int, str, dict[str, Any]], None]
+
+# 流式输出时用于切分句子的结束符
+_SENTENCE_ENDINGS = frozenset("。！？!?.\n")
+
+
+def _last_sentence_end(text: str) -> int:
+    """返回文本中最后一个句子结束符的位置,没有则返回 -1."""
+    for index in range(len(text) - 1, -1, -1):
+        if text[index] in _SENTENCE_ENDINGS:
+            return index
+    return -1
+
+
+# 直接以工具参数调用同名模拟器方法的单设备控制工具
+_DEVICE_TOOLS = (
+    "turn_on_light",
+    "turn_off_light",
+    "set_light_brightness",
+    "set_light_color",
+    "set_temperature",
+    "turn_on_fan",
+    "turn_off_fan",
+    "set_fan_speed",
+    "open_curtain",
+    "close_curtain",
+    "lock_door",
+    "unlock_door",
+)
+
+# 调用同名模拟器方法、逐行返回各设备结果的批量控制工具
+_BULK_TOOLS = (
+    "turn_off_all_lights",
+    "turn_on_all_lights",
+    "lock_all_doors",
+    "unlock_all_doors",
+    "close_all_curtains",
+    "open_all_curtains",
+)
+
+
+# 工具定义表: (工具名称, 描述, device_id 参数的设备类型, 其他参数)
+# 设备类型为 "*" 时可选所有设备,为 None 时工具不接收 device_id; 所有参数均为必填
+_TOOL_SPECS: tuple[tuple[str, str, str | None, dict[str, dict[str, Any]]], ...] = (
+    # ========== 查询工具 (QUERY - 不改变状态) ==========
+    (
+        "get_device_state",
+        "查询单个设备的当前状态(不改变设备状态)。当用户询问某个设备的状态时使用此工具。",
+        "*",
+        {},
+    ),
+    (
+        "get_all_device_statuses",
+        "获取所有设备的当前状态(不改变任何设备状态)。当用户询问整体状态或需要查看所有设备时使用。",
+        None,
+        {},
+    ),
+    # ========== 控制工具 (COMMAND - 会改变状态) ==========
+    ("turn_on_light", "打开指定的灯光设备 (改变状态)", "light", {}),
+    ("turn_off_light", "关闭指定的灯光设备 (改变状态)", "light", {}),
+    (
+        "set_light_brightness",
+        "设置灯光的亮度级别 (改变状态)",
+        "light",
+        {
+            "level": {
+                "type": "integer",
+                "description": "亮度级别,范围 0-100,0为关闭,100为最亮",
+                "minimum": 0,
+                "maximum": 100,
+            }
+        },
+    ),
+    (
+        "set_light_color",
+        "设置灯光的颜色 (改变状态)",
+        "light",
+        {
+            "color": {
+                "type": "string",
+                "description": "颜色名称或十六进制值 (例如: red, blue, white)",
+            }
+        },
+    ),
+    (
+        "set_temperature",
+        "设置温控器的目标温度 (改变状态)",
+        "thermostat",
+        {
+            "temp": {
+                "type": "number",
+                "description": "目标温度 (摄氏度),范围 16-30",
+                "minimum": 16,
+                "maximum": 30,
+            }
+        },
+    ),
+    ("turn_on_fan", "打开指定的风扇设备 (改变状态)", "fan", {}),
+    ("turn_off_fan", "关闭指定的风扇设备 (改变状态)", "fan", {}),
+    (
+        "set_fan_speed",
+        "设置风扇的速度等级 (改变状态)",
+        "fan",
+        {
+            "speed": {
+                "type": "integer",
+                "description": "速度等级,1为低速,2为中速,3为高速",
+                "minimum": 1,
+                "maximum": 3,
+            }
+        },
+    ),
+    ("open_curtain", "打开指定的窗帘 (改变状态)", "curtain", {}),
+    ("close_curtain", "关闭指定的窗帘 (改变状态)", "curtain", {}),
+    ("lock_door", "锁定指定的门 (改变状态)", "door", {}),
+    ("unlock_door", "解锁指定的门 (改变状态)", "door", {}),
+    # ========== 批量控制工具 (COMMAND - 会改变多个设备状态) ==========
+    ("turn_off_all_lights", "关闭所有的灯光设备 (通常用于睡觉、离家等场景 - 改变状态)", None, {}),
+    ("turn_on_all_lights", "打开所有的灯光设备 (改变状态)", None, {}),
+    ("lock_all_doors", "锁定所有的门 (通常用于离家、睡觉等场景 - 改变状态)", None, {}),
+    ("unlock_all_doors", "解锁所有的门 (通常用于回家场景 - 改变状态)", None, {}),
+    ("close_all_curtains", "关闭所有的窗帘 (通常用于看电视、睡觉等场景 - 改变状态)", None, {}),
+    ("open_all_curtains", "打开所有的窗帘 (通常用于起床、早上等场景 - 改变状态)", None, {}),
+)
+
+
+# 系统提示词中设备列表之前的部分
+_SYSTEM_PROMPT_HEADER = (
+    "# 智能家居控制助手\n\n"
+    "你是一个专业的智能家居控制助手。用户会用自然语言描述他们的需求，你需要理解并控制相应的设备。\n\n"
+    "## 可用设备列表\n"
+)
+
+# 系统提示词中设备列表之后的部分: 意图分类规则与示例
+_SYSTEM_PROMPT_RULES = (
+    "## 思维协议 (Thought Protocol) - 必须严格遵循\n\n"
+    "处理请求前，先判断用户输入属于哪一类意图：\n\n"
+    "**CATEGORY: QUERY (查询)** - 询问信息、状态、当前值 "
+    "(\"多少\"、\"是什么\"、\"怎么样\"、\"开了吗\")\n"
+    "- 仅使用 get_device_state 或 get_all_device_statuses\n"
+    "- **禁止**: 任何会改变状态的工具 (set_*, turn_*, open_*, close_*, lock_*, unlock_*)\n\n"
+    "**CATEGORY: COMMAND (命令)** - 要求改变、调整、操作设备 "
+    "(\"打开\"、\"关闭\"、\"设置\"、\"太热\"、\"太冷\"、\"我要\"、场景描述)\n"
+    "- 使用控制工具 (set_*, turn_*, open_*, close_*, lock_*, unlock_*)\n"
+    "- 优先使用批量操作工具 (如 turn_off_all_lights 而非单独关闭每个灯)\n\n"
+    "**CATEGORY: CHIT-CHAT (闲聊)** - 问候、感谢等一般性对话\n"
+    "- 不使用任何工具，直接回复文本\n\n"
+    "**黄金法则**: 如果用户问\"X是什么/多少/怎么样\"，绝不能改变 X，只能查询并报告\n\n"
+    "## 示例\n\n"
+    "- \"现在温度多少?\" → QUERY → get_device_state(device_id=\"thermostat\")\n"
+    "- \"客厅灯开着吗?\" → QUERY → get_device_state(device_id=\"living_room_light\")\n"
+    "- \"所有设备状态怎么样?\" → QUERY → get_all_device_statuses()\n"
+    "- \"太冷了\" → COMMAND → set_temperature(device_id=\"thermostat\", temp=25)\n"
+    "- \"太热了\" → COMMAND → set_temperature(20-22) 或 turn_on_fan\n"
+    "- \"打开客厅灯\" → COMMAND → turn_on_light(device_id=\"living_room_light\")\n"
+    "- \"睡觉了\"/\"晚安\"/\"出门\" → COMMAND → turn_off_all_lights, lock_all_doors\n"
+    "- \"回家啦\" → COMMAND → turn_on_light(living_room_light), unlock_all_doors\n"
+    "- \"看电视\" → COMMAND → set_light_brightness(living_room_light, 30), close_all_curtains\n"
+    "- \"起床\"/\"早上好\" → COMMAND → open_all_curtains\n"
+    "- \"太亮了\" → COMMAND → set_light_brightness 或 close_curtain\n"
+)
+
+# 快速路径: 整句匹配的批量指令 -> 工具名称
+_FAST_PATH_BULK = {
+    "打开所有灯": "turn_on_all_lights",
+    "关闭所有灯": "turn_off_all_lights",
+    "关掉所有灯": "turn_off_all_lights",
+    "锁上所有门": "lock_all_doors",
+    "打开所有窗帘": "open_all_curtains",
+    "关闭所有窗帘": "close_all_curtains",
+}
+
+# 快速路径: (动作 + 设备名称的正则, 设备类型 -> 工具名称)
+_FAST_PATH_RULES: tuple[tuple[re.Pattern[str], dict[str, str]], ...] = (
+    (
+        re.compile(r"(?:请)?(?:打开|开启)(.+)"),
+        {"light": "turn_on_light", "fan": "turn_on_fan", "curtain": "open_curtain"},
+    ),
+    (
+        re.compile(r"(?:请)?(?:关闭|关掉|关上)(.+)"),
+        {"light": "turn_off_light", "fan": "turn_off_fan", "curtain": "close_curtain"},
+    ),
+    (re.compile(r"(?:请)?解锁(.+)"), {"door": "unlock_door"}),
+    (re.compile(r"(?:请)?(?:锁上|锁好)(.+)"), {"door": "lock_door"}),
+)
+
+
+def _tool_call(tool_name: str, arguments: dict[str, Any]) -> dict[str, Any]:
+    """构造与 LLM 返回格式相同的工具调用."""
+    return {
+        "type": "function",
+        "function": {"name": tool_name, "arguments": orjson.dumps(arguments).decode()},
+    }
+
+
+def _parse_arguments(raw: str) -> dict[str, Any]:
+    """解析工具调用的参数 JSON; 无参数工具常见的 "" 与 "{}" (及纯空白) 直接返回空字典."""
+    if not raw or raw == "{}" or raw.isspace():
+        return {}
+    return orjson.loads(raw)
+
+
+def _device_tool(method: Callable[..., str]) -> Callable[[dict[str, Any]], str]:
+    """将模拟器的单设备方法包装为工具处理函数."""
+    return lambda arguments: method(**arguments)
+
+
+def _bulk_tool(method: Callable[[], list[str]]) -> Callable[[dict[str, Any]], str]:
+    """将模拟器的批量方法包装为工具处理函数 (忽略参数,结果逐行合并)."""
+    return lambda arguments: "\n".join(method())
+
+
+@functools.lru_cache(maxsize=16)
+def _build_tools(
+    all_devices: tuple[str, ...], devices_by_type: tuple[tuple[str, tuple[str, ...]], ...]
+) -> list[dict[str, Any]]:
+    """按工具定义表与设备集合生成工具定义,相同设备集合的结果在所有 Agent 间共享.
+
+    Args:
+        all_devices: 所有设备ID
+        devices_by_type: (设备类型, 该类型的设备ID) 序列
+
+    Returns:
+        工具定义列表
+    """
+    enums = {device_type: list(device_ids) for device_type, device_ids in devices_by_type}
+    enums["*"] = list(all_devices)
+
+    tools = []
+    for tool_name, description, device_type, extra_properties in _TOOL_SPECS:
+        properties: dict[str, Any] = {}
+        if device_type is not None:
+            # 参数名与 enum 已说明取值,device_id 不再附带描述以缩小每次请求的工具定义
+            properties["device_id"] = {"type": "string", "enum": enums.get(device_type, [])}
+        properties.update(extra_properties)
+
+        parameters: dict[str, Any] = {"type": "object", "properties": properties}
+        if properties:
+            parameters["required"] = list(properties)
+        tools.append(
+            {
+                "type": "function",
+                "function": {
+                    "name": tool_name,
+                    "description": description,
+                    "parameters": parameters,
+                },
+            }
+        )
+    return tools
+
+
+def _compile_validator(parameters: dict[str, Any]) -> Callable[[dict[str, Any]], str | None]:
+    """根据工具参数的 JSON Schema 生成校验函数.
+
+    只覆盖工具定义实际用到的约束: required、enum、数值类型及 minimum/maximum.
+
+    Args:
+        parameters: 工具定义中的 parameters 对象
+
+    Returns:
+        校验函数,参数合法时返回 None,否则返回错误描述
+    """
+    required = tuple(parameters.get("required", ()))
+    checks = tuple(
+        (
+            name,
+            frozenset(spec["enum"]) if "enum" in spec else None,
+            spec.get("type") in ("integer", "number"),
+            spec.get("minimum"),
+            spec.get("maximum"),
+        )
+        for name, spec in parameters.get("properties", {}).items()
+    )
+
+    def validate(arguments: dict[str, Any]) -> str | None:
+        for name in required:
+            if name not in arguments:
+                return f"缺少参数 '{name}'"
+        for name, enum, numeric, minimum, maximum in checks:
+            if name not in arguments:
+                continue
+            value = arguments[name]
+            if enum is not None and value not in enum:
+                return f"参数 '{name}' 的值 {value!r} 不在可选范围内"
+            if numeric:
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    return f"参数 '{name}' 必须是数字"
+                if (minimum is not None and value < minimum) or (
+                    maximum is not None and value > maximum
+                ):
+                    return f"参数 '{name}' 的值 {value} 超出范围 [{minimum}, {maximum}]"
+        return None
+
+    return validate
+
+
+# action_id 后缀计数器,保证同一纳秒内生成的ID也不重复
+_action_counter = itertools.count()
+
+# process_sync 使用的常驻后台事件循环,多次同步调用复用同一循环及其 HTTP 连接池
+_sync_loop: asyncio.AbstractEventLoop | None = None
+_sync_thread: threading.Thread | None = None
+_sync_loop_lock = threading.Lock()
+
+
+def _get_sync_loop() -> asyncio.AbstractEventLoop:
+    """获取 (首次调用时启动) 在守护线程中运行的后台事件循环."""
+    global _sync_loop, _sync_thread
+    with _sync_loop_lock:
+        if _sync_loop is None:
+            loop = asyncio.new_event_loop()
+            _sync_thread = threading.Thread(
+                target=loop.run_forever, name="smarthome-agent-loop", daemon=True
+            )
+            _sync_thread.start()
+            _sync_loop = loop
+            atexit.register(_stop_sync_loop)
+    return _sync_loop
+
+
+async def _cancel_pending_tasks() -> None:
+    """取消当前事件循环上其余的任务并等待其结束 (与 asyncio.run 退出时的处理相同)."""
+    tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def _stop_sync_loop() -> None:
+    """停止后台事件循环并等待其线程退出 (解释器退出时自动调用)."""
+    global _sync_loop
+    with _sync_loop_lock:
+        loop, _sync_loop = _sync_loop, None
+    if loop is None:
+        return
+    atexit.unregister(_stop_sync_loop)
+    # 先让剩余任务结束,其中包括关闭各 Agent 在此循环上的 HTTP 客户端
+    try:
+        asyncio.run_coroutine_threadsafe(_cancel_pending_tasks(), loop).result(timeout=5.0)
+    except concurrent.futures.TimeoutError:
+        log.warning("后台事件循环上的任务未能在超时前结束")
+    loop.call_soon_threadsafe(loop.stop)
+    if _sync_thread is not None:
+        _sync_thread.join(timeout=5.0)
+        if not _sync_thread.is_alive():
+            loop.close()
+
 
 class SmartHomeAgent:
     """智能家居 AI Agent."""
@@ -17,25 +387,74 @@ class SmartHomeAgent:
     # API 配置
     API_URL = "https://open.bigmodel.cn/api/paas/v4/chat/completions"
 
+    # 工具调用缓存的最大条目数
+    RESPONSE_CACHE_SIZE = 512
+
     @property
     def API_KEY(self) -> str:
-        """获取 API Key."""
-        return os.getenv("ZHIPU_API_KEY", "")
-
-    def __init__(self, simulator: Any, enable_logging: bool = True, enable_learning: bool = True) -> None:
+        """获取 API Key (创建 Agent 时读取,可通过 refresh_api_key 重新读取)."""
+        return self._api_key
+
+    def __init__(
+        self,
+        simulator: Any,
+        enable_logging: bool = True,
+        enable_learning: bool = True,
+        enable_http2: bool = True,
+    ) -> None:
         """初始化 Agent.
 
         Args:
             simulator: HomeSimulator 实例
             enable_logging: 是否启用交互日志记录
             enable_learning: 是否启用习惯学习功能
+            enable_http2: 是否在安装了 h2 时使用 HTTP/2 (设为 False 强制使用 HTTP/1.1)
         """
         self.simulator = simulator
+        self._debug = os.getenv("SMARTHOME_DEBUG", "0") not in ("", "0")
+        # 工具定义与系统提示词只依赖设备集合,按模拟器的 topology_version 缓存
+        self._topology_version = simulator.topology_version
         self.tools = self._define_tools()
+        self._payload_prefix = self._encode_payload_prefix()
+        self._device_index = self._build_device_index()
+        self._tool_handlers = self._build_tool_handlers()
+        self._validators = self._build_validators()
+        self._system_prompt: str | None = None
+        self._system_message: dict[str, str] | None = None
+        # 工具在工作线程中执行,用线程锁串行化对模拟器的修改 (与调用方所在的事件循环无关)
+        self._tool_lock = threading.Lock()
+        # (规范化的用户输入, topology_version) -> LLM 返回的工具调用, LRU 淘汰
+        self._response_cache: OrderedDict[tuple[str, int], list[dict[str, Any]]] = OrderedDict()
+        # action_id -> 该动作所用 (或写入) 的缓存键,收到负面反馈时据此淘汰缓存
+        self._cached_actions: OrderedDict[str, tuple[str, int]] = OrderedDict()
+        # process() 与 process_sync() (后台事件循环线程) 可能同时读写上面两个 OrderedDict
+        self._cache_lock = threading.Lock()
+        # 正在进行中的 LLM 请求,相同键的并发请求 (在同一事件循环上) 共享同一次调用结果;
+        # 键中含事件循环,不同线程上的循环互不访问对方的条目,因此无需加锁
+        self._inflight: dict[
+            tuple[tuple[str, int], asyncio.AbstractEventLoop], asyncio.Task[dict[str, Any]]
+        ] = {}
+        # 连接池绑定创建它的事件循环,每个事件循环 (如 process_sync 的后台循环) 各用一个客户端
+        self._clients: dict[asyncio.AbstractEventLoop, httpx.AsyncClient] = {}
+        # 每个客户端对应一个守护任务,事件循环退出取消剩余任务时由它关闭客户端
+        self._client_guards: dict[asyncio.AbstractEventLoop, asyncio.Task[None]] = {}
+        self.enable_http2 = enable_http2 and h2 is not None
+        # API Key 与对应的请求头只在创建时 (及 refresh_api_key) 读取环境变量
+        self._api_key = ""
+        self._headers: dict[str, str] | None = None
+        self.refresh_api_key()
         self.enable_logging = enable_logging
         self.enable_learning = enable_learning
         self.logger: InteractionLogger | None = get_interaction_logger() if enable_logging else None
-        self.preference_model: PreferenceModel | None = get_preference_model() if enable_learning else None
+        # 交互记录由单个后台线程按提交顺序写入 SQLite,process() 不等待写入完成;
+        # action_id -> 尚未写完的记录,记录反馈前通过 flush_logs() 等待
+        self._log_writer = concurrent.futures.ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="interaction-log"
+        )
+        self._pending_logs: dict[str, concurrent.futures.Future[None]] = {}
+        self.preference_model: PreferenceModel | None = (
+            get_preference_model() if enable_learning else None
+        )
 
         # Load existing preferences if available
         if self.preference_model:
@@ -45,361 +464,53 @@ class SmartHomeAgent:
         """定义可用的工具/函数.
 
         Returns:
-            工具定义列表
+            工具定义列表 (设备集合相同的 Agent 共享同一份,调用方不应修改)
         """
         # Get dynamic device list for enum values
-        all_devices = self.simulator.list_all_devices()
-        all_metadata = self.simulator.get_all_metadata()
+        all_devices = tuple(self.simulator.list_all_devices())
 
-        # Group devices by type
-        devices_by_type: dict[str, list[str]] = {}
-        for device_id, metadata in all_metadata.items():
-            device_type = metadata["device_type"]
-            if device_type not in devices_by_type:
-                devices_by_type[device_type] = []
-            devices_by_type[device_type].append(device_id)
+        # Group devices by type (shared by all agents on this simulator)
+        devices_by_type = tuple(
+            (device_type, tuple(device_ids))
+            for device_type, device_ids in self.simulator.group_devices_by_type().items()
+        )
 
-        tools = [
-            # ========== 查询工具 (QUERY - 不改变状态) ==========
-            {
-                "type": "function",
-                "function": {
-                    "name": "get_device_state",
-                    "description": "查询单个设备的当前状态(不改变设备状态)。当用户询问某个设备的状态时使用此工具。",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "device_id": {
-                                "type": "string",
-                                "description": "设备ID",
-                                "enum": all_devices,
-                            }
-                        },
-                        "required": ["device_id"],
-                    },
-                },
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "get_all_device_statuses",
-                    "description": "获取所有设备的当前状态(不改变任何设备状态)。当用户询问整体状态或需要查看所有设备时使用。",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {},
-                    },
-                },
-            },
-            # ========== 控制工具 (COMMAND - 会改变状态) ==========
-            {
-                "type": "function",
-                "function": {
-                    "name": "turn_on_light",
-                    "description": "打开指定的灯光设备 (改变状态)",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "device_id": {
-                                "type": "string",
-                                "description": "灯光设备ID",
-                                "enum": devices_by_type.get("light", []),
-                            }
-                        },
-                        "required": ["device_id"],
-                    },
-                },
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "turn_off_light",
-                    "description": "关闭指定的灯光设备 (改变状态)",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "device_id": {
-                                "type": "string",
-                                "description": "灯光设备ID",
-                                "enum": devices_by_type.get("light", []),
-                            }
-                        },
-                        "required": ["device_id"],
-                    },
-                },
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "set_light_brightness",
-                    "description": "设置灯光的亮度级别 (改变状态)",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "device_id": {
-                                "type": "string",
-                                "description": "灯光设备ID",
-                                "enum": devices_by_type.get("light", []),
-                            },
-                            "level": {
-                                "type": "integer",
-                                "description": "亮度级别,范围 0-100,0为关闭,100为最亮",
-                                "minimum": 0,
-                                "maximum": 100,
-                            },
-                        },
-                        "required": ["device_id", "level"],
-                    },
-                },
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "set_light_color",
-                    "description": "设置灯光的颜色 (改变状态)",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "device_id": {
-                                "type": "string",
-                                "description": "灯光设备ID",
-                                "enum": devices_by_type.get("light", []),
-                            },
-                            "color": {
-                                "type": "string",
-                                "description": "颜色名称或十六进制值 (例如: red, blue, white)",
-                            },
-                        },
-                        "required": ["device_id", "color"],
-                    },
-                },
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "set_temperature",
-                    "description": "设置温控器的目标温度 (改变状态)",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "device_id": {
-                                "type": "string",
-                                "description": "温控器设备ID",
-                                "enum": devices_by_type.get("thermostat", []),
-                            },
-                            "temp": {
-                                "type": "number",
-                                "description": "目标温度 (摄氏度),范围 16-30",
-                                "minimum": 16,
-                                "maximum": 30,
-                            },
-                        },
-                        "required": ["device_id", "temp"],
-                    },
-                },
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "turn_on_fan",
-                    "description": "打开指定的风扇设备 (改变状态)",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "device_id": {
-                                "type": "string",
-                                "description": "风扇设备ID",
-                                "enum": devices_by_type.get("fan", []),
-                            }
-                        },
-                        "required": ["device_id"],
-                    },
-                },
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "turn_off_fan",
-                    "description": "关闭指定的风扇设备 (改变状态)",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "device_id": {
-                                "type": "string",
-                                "description": "风扇设备ID",
-                                "enum": devices_by_type.get("fan", []),
-                            }
-                        },
-                        "required": ["device_id"],
-                    },
-                },
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "set_fan_speed",
-                    "description": "设置风扇的速度等级 (改变状态)",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "device_id": {
-                                "type": "string",
-                                "description": "风扇设备ID",
-                                "enum": devices_by_type.get("fan", []),
-                            },
-                            "speed": {
-                                "type": "integer",
-                                "description": "速度等级,1为低速,2为中速,3为高速",
-                                "minimum": 1,
-                                "maximum": 3,
-                            },
-                        },
-                        "required": ["device_id", "speed"],
-                    },
-                },
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "open_curtain",
-                    "description": "打开指定的窗帘 (改变状态)",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "device_id": {
-                                "type": "string",
-                                "description": "窗帘设备ID",
-                                "enum": devices_by_type.get("curtain", []),
-                            }
-                        },
-                        "required": ["device_id"],
-                    },
-                },
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "close_curtain",
-                    "description": "关闭指定的窗帘 (改变状态)",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "device_id": {
-                                "type": "string",
-                                "description": "窗帘设备ID",
-                                "enum": devices_by_type.get("curtain", []),
-                            }
-                        },
-                        "required": ["device_id"],
-                    },
-                },
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "lock_door",
-                    "description": "锁定指定的门 (改变状态)",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "device_id": {
-                                "type": "string",
-                                "description": "门锁设备ID",
-                                "enum": devices_by_type.get("door", []),
-                            }
-                        },
-                        "required": ["device_id"],
-                    },
-                },
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "unlock_door",
-                    "description": "解锁指定的门 (改变状态)",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "device_id": {
-                                "type": "string",
-                                "description": "门锁设备ID",
-                                "enum": devices_by_type.get("door", []),
-                            }
-                        },
-                        "required": ["device_id"],
-                    },
-                },
-            },
-            # ========== 批量控制工具 (COMMAND - 会改变多个设备状态) ==========
-            {
-                "type": "function",
-                "function": {
-                    "name": "turn_off_all_lights",
-                    "description": "关闭所有的灯光设备 (通常用于睡觉、离家等场景 - 改变状态)",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {},
-                    },
-                },
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "turn_on_all_lights",
-                    "description": "打开所有的灯光设备 (改变状态)",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {},
-                    },
-                },
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "lock_all_doors",
-                    "description": "锁定所有的门 (通常用于离家、睡觉等场景 - 改变状态)",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {},
-                    },
-                },
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "unlock_all_doors",
-                    "description": "解锁所有的门 (通常用于回家场景 - 改变状态)",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {},
-                    },
-                },
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "close_all_curtains",
-                    "description": "关闭所有的窗帘 (通常用于看电视、睡觉等场景 - 改变状态)",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {},
-                    },
-                },
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "open_all_curtains",
-                    "description": "打开所有的窗帘 (通常用于起床、早上等场景 - 改变状态)",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {},
-                    },
-                },
-            },
-        ]
-        return tools
+        return _build_tools(all_devices, devices_by_type)
+
+    def _sync_topology(self) -> None:
+        """设备集合变化后重建工具定义,并使系统提示词缓存失效."""
+        version = self.simulator.topology_version
+        if version != self._topology_version:
+            self._topology_version = version
+            self.tools = self._define_tools()
+            self._payload_prefix = self._encode_payload_prefix()
+            self._device_index = self._build_device_index()
+            self._validators = self._build_validators()
+            self._system_prompt = None
 
     def _build_system_prompt(self) -> str:
+        """获取系统提示词,设备集合未变化时复用缓存.
+
+        Returns:
+            系统提示词字符串
+        """
+        self._sync_topology()
+        if self._system_prompt is None:
+            self._system_prompt = self._render_system_prompt()
+        return self._system_prompt
+
+    def _build_system_message(self) -> dict[str, str]:
+        """获取系统消息,与系统提示词缓存一同失效.
+
+        Returns:
+            role 为 system 的消息字典 (各请求共享,不可修改)
+        """
+        prompt = self._build_system_prompt()
+        if self._system_message is None or self._system_message["content"] is not prompt:
+            self._system_message = {"role": "system", "content": prompt}
+        return self._system_message
+
+    def _render_system_prompt(self) -> str:
         """构建系统提示词 with Thought Protocol.
 
         Returns:
@@ -407,78 +518,181 @@ class SmartHomeAgent:
         """
         all_metadata = self.simulator.get_all_metadata()
 
-        # Build device list string
-        device_list_str = ""
-        for device_id, metadata in all_metadata.items():
-            device_list_str += f"  - {device_id}: {metadata['name']} ({metadata['device_type']})\n"
+        device_list_str = "\n".join(
+            f"  - {device_id}: {metadata['name']} ({metadata['device_type']})"
+            for device_id, metadata in all_metadata.items()
+        )
+        return f"{_SYSTEM_PROMPT_HEADER}{device_list_str}\n\n{_SYSTEM_PROMPT_RULES}"
+
+    def _encode_payload_prefix(self) -> bytes:
+        """预先序列化请求体中不随请求变化的部分 (模型参数与工具定义).
 
+        Returns:
+            以 "{" 开头、未闭合的 JSON 字节串
+        """
         return (
-            "# 智能家居控制助手\n\n"
-            "你是一个专业的智能家居控制助手。用户会用自然语言描述他们的需求，你需要理解并控制相应的设备。\n\n"
-            "## 可用设备列表\n"
-            f"{device_list_str}\n"
-            "## 思维协议 (Thought Protocol) - 必须严格遵循\n\n"
-            "在处理用户请求之前，你必须先进行意图分类。按以下步骤思考：\n\n"
-            "### 步骤 1: 意图分类\n"
-            "判断用户输入属于以下哪一类：\n\n"
-            "**CATEGORY: QUERY (查询)**\n"
-            "- 用户询问信息、状态、当前值\n"
-            "- 关键词: \"多少\"、\"是什么\"、\"怎么样\"、\"温度\"、\"状态\"、\"亮度\"、\"开了吗\"\n"
-            "- 规则: **仅使用 get_device_state 或 get_all_device_statuses**\n"
-            "- **禁止**: 任何会改变状态的工具 (set_*, turn_*, open_*, close_*, lock_*, unlock_*)\n\n"
-            "**CATEGORY: COMMAND (命令)**\n"
-            "- 用户要求改变、调整、操作设备\n"
-            "- 关键词: \"打开\"、\"关闭\"、\"设置\"、\"太热\"、\"太冷\"、\"我要\"、场景描述\n"
-            "- 规则: **使用控制工具** (set_*, turn_*, open_*, close_*, lock_*, unlock_*)\n\n"
-            "**CATEGORY: CHIT-CHAT (闲聊)**\n"
-            "- 一般性对话、问候、感谢\n"
-            "- 规则: **不使用任何工具**，直接回复文本\n\n"
-            "### 步骤 2: 执行验证\n"
-            "- 如果是 QUERY：只能使用查询工具，绝对不能调用任何会改变状态的工具\n"
-            "- 如果是 COMMAND：使用相应的控制工具\n"
-            "- 如果用户问\"X是什么\"，绝不能改变 X，只能报告 X 的状态\n\n"
-            "## 示例 (Few-Shot Examples)\n\n"
-            "### QUERY 示例 (只查询，不改变状态):\n\n"
-            "用户: \"现在温度多少?\"\n"
-            "思考: 用户询问当前温度 → QUERY 类别 → 使用 get_device_state 查询 thermostat\n"
-            "工具: get_device_state(device_id=\"thermostat\")\n\n"
-            "用户: \"客厅灯开着吗?\"\n"
-            "思考: 用户询问灯的状态 → QUERY 类别 → 使用 get_device_state 查询\n"
-            "工具: get_device_state(device_id=\"living_room_light\")\n\n"
-            "用户: \"所有设备状态怎么样?\"\n"
-            "思考: 用户询问整体状态 → QUERY 类别 → 使用 get_all_device_statuses\n"
-            "工具: get_all_device_statuses()\n\n"
-            "### COMMAND 示例 (执行操作):\n\n"
-            "用户: \"太冷了\"\n"
-            "思考: 用户表示冷，暗示需要升温 → COMMAND 类别 → 设置温度\n"
-            "工具: set_temperature(device_id=\"thermostat\", temp=25)\n\n"
-            "用户: \"打开客厅灯\"\n"
-            "思考: 用户明确要求开灯 → COMMAND 类别 → 打开灯光\n"
-            "工具: turn_on_light(device_id=\"living_room_light\")\n\n"
-            "用户: \"我要睡觉了\"\n"
-            "思考: 用户场景暗示需要关灯 → COMMAND 类别 → 关闭所有灯\n"
-            "工具: turn_off_all_lights()\n\n"
-            "### 关键规则:\n\n"
-            "1. **黄金法则**: 如果用户问\"X是什么/多少/怎么样\"，绝不能改变 X，只能查询并报告\n"
-            "2. QUERY 类别只能用: get_device_state, get_all_device_statuses\n"
-            "3. COMMAND 类别才能用: set_*, turn_*, open_*, close_*, lock_*, unlock_*\n"
-            "4. 优先使用批量操作工具 (如 turn_off_all_lights 而非单独关闭每个灯)\n\n"
-            "## 常见场景处理:\n\n"
-            "- \"太热了\" → COMMAND → set_temperature(20-22) 或 turn_on_fan\n"
-            "- \"太冷了\" → COMMAND → set_temperature(25-26)\n"
-            "- \"睡觉了\"/\"晚安\" → COMMAND → turn_off_all_lights, lock_all_doors\n"
-            "- \"出门\"/\"离开\" → COMMAND → turn_off_all_lights, lock_all_doors\n"
-            "- \"回家\"/\"回家啦\" → COMMAND → turn_on_light(living_room_light), unlock_all_doors\n"
-            "- \"看电视\" → COMMAND → set_light_brightness(living_room_light, 30), close_all_curtains\n"
-            "- \"起床\"/\"早上好\" → COMMAND → open_all_curtains\n"
-            "- \"太亮了\" → COMMAND → set_light_brightness 或 close_curtain\n\n"
-            "## 重要提醒:\n\n"
-            "- 先思考意图类别，再选择工具\n"
-            "- QUERY 请求只查询，不改变状态\n"
-            "- COMMAND 请求才改变状态\n"
-            "- 当用户询问\"现在温度多少\"、\"灯开着吗\"等问题时，**必须**使用 get_device_state，**禁止**使用 set_temperature\n"
+            b'{"model":"glm-4-flash","tool_choice":"auto","temperature":0.7,"max_tokens":2048,'
+            b'"tools":' + orjson.dumps(self.tools)
         )
 
+    def _build_body(self, messages: list[dict[str, Any]], stream: bool = False) -> bytes:
+        """构建 LLM 请求体,拼接预序列化的静态部分与本次消息.
+
+        Args:
+            messages: 消息列表
+            stream: 是否请求流式响应
+
+        Returns:
+            JSON 编码的请求体
+        """
+        stream_field = b',"stream":true' if stream else b""
+        return self._payload_prefix + stream_field + b',"messages":' + orjson.dumps(messages) + b"}"
+
+    def _get_client(self) -> httpx.AsyncClient:
+        """获取当前事件循环上复用的 HTTP 客户端,首次调用时创建.
+
+        Returns:
+            在多次请求间保持连接的 httpx.AsyncClient
+        """
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None or client.is_closed:
+            # 事件循环关闭后其上的连接已无法再关闭 (asyncio.run 退出时守护任务已关闭客户端,
+            # 不取消任务就直接关闭的循环除外),这里只移除引用
+            for other in list(self._clients):
+                if other.is_closed():
+                    self._clients.pop(other, None)
+                    self._client_guards.pop(other, None)
+            # 配置 HTTP 客户端,禁用代理以避免连接问题; 可用时启用 HTTP/2 复用单条连接
+            client = self._clients[loop] = httpx.AsyncClient(
+                timeout=30.0,
+                proxy=None,
+                http2=self.enable_http2,
+                # 空闲连接 15 秒后关闭,早于服务端的空闲超时,避免复用已被服务端断开的连接
+                limits=httpx.Limits(
+                    max_keepalive_connections=20, max_connections=50, keepalive_expiry=15.0
+                ),
+                headers={"Content-Type": "application/json"},
+            )
+            self._client_guards[loop] = loop.create_task(self._close_client_on_exit(client))
+        return client
+
+    async def _close_client_on_exit(self, client: httpx.AsyncClient) -> None:
+        """守护任务: 一直等待,被取消时 (事件循环退出或 aclose) 关闭客户端的连接池.
+
+        Args:
+            client: 要关闭的 HTTP 客户端
+        """
+        try:
+            await asyncio.get_running_loop().create_future()
+        finally:
+            loop = asyncio.get_running_loop()
+            if self._clients.get(loop) is client:
+                del self._clients[loop]
+                self._client_guards.pop(loop, None)
+            await client.aclose()
+
+    def refresh_api_key(self) -> None:
+        """重新读取环境变量 ZHIPU_API_KEY,并重建请求头."""
+        self._api_key = os.getenv("ZHIPU_API_KEY", "")
+        self._headers = {"Authorization": f"Bearer {self._api_key}"} if self._api_key else None
+
+    def _auth_headers(self) -> dict[str, str] | None:
+        """获取携带 API Key 的请求头 (各请求共享同一字典).
+
+        Returns:
+            请求头字典; 未设置 API Key 时返回 None
+        """
+        return self._headers
+
+    async def warmup(self) -> None:
+        """预先建立到 LLM 接口的连接 (TCP + TLS),使首个请求复用已打开的连接.
+
+        通常以后台任务启动且无人等待结果,预热失败不影响后续请求,任何异常都只记录调试日志.
+        """
+        if not self.API_KEY:
+            return
+        try:
+            await self._get_client().head(self.API_URL)
+        except Exception:
+            log.debug("连接预热失败", exc_info=True)
+
+    async def aclose(self) -> None:
+        """等待尚未写完的交互记录,并关闭当前事件循环上复用的 HTTP 客户端."""
+        await self.flush_logs()
+        loop = asyncio.get_running_loop()
+        client = self._clients.pop(loop, None)
+        guard = self._client_guards.pop(loop, None)
+        if guard is not None:
+            guard.cancel()
+        if client is not None:
+            await client.aclose()
+
+    def close_sync(self) -> None:
+        """关闭 process_sync 使用的 HTTP 客户端 (同步代码中代替 aclose)."""
+        loop = _sync_loop
+        if loop is not None and loop.is_running():
+            asyncio.run_coroutine_threadsafe(self.aclose(), loop).result()
+
+    async def __aenter__(self) -> "SmartHomeAgent":
+        """以 async with 使用 Agent,退出时自动调用 aclose()."""
+        return self
+
+    async def __aexit__(self, *exc_info: object) -> None:
+        """退出 async with 时释放连接."""
+        await self.aclose()
+
+    def _unexpected_error(self, error: Exception) -> dict[str, str]:
+        """构造未预期异常的错误响应,仅在调试模式 (SMARTHOME_DEBUG=1) 下附带堆栈.
+
+        Args:
+            error: 捕获到的异常 (须在 except 块内调用)
+
+        Returns:
+            错误响应字典
+        """
+        if self._debug:
+            return {"error": f"请求异常: {error}\n{traceback.format_exc()}"}
+        # 堆栈交给日志系统,仅在启用 DEBUG 级别时才会格式化
+        log.debug("LLM 请求异常", exc_info=True)
+        return {"error": f"请求异常: {type(error).__name__}: {error}"}
+
+    def _log_interaction(self, **record: Any) -> None:
+        """把交互记录交给后台写入线程,不等待 SQLite 写入完成.
+
+        写入线程不是守护线程,调用方结束事件循环 (如 asyncio.run) 或退出解释器时
+        已提交的记录仍会写完.
+
+        Args:
+            **record: InteractionLogger.log_interaction 的参数
+        """
+        action_id = record["action_id"]
+        future = self._log_writer.submit(self._write_interaction, self.logger, record)
+        self._pending_logs[action_id] = future
+        future.add_done_callback(lambda _: self._pending_logs.pop(action_id, None))
+
+    @staticmethod
+    def _write_interaction(logger: InteractionLogger, record: dict[str, Any]) -> None:
+        """在后台写入线程中写入一条交互记录,失败时只记录日志."""
+        try:
+            logger.log_interaction(**record)
+        except Exception:
+            log.exception("写入交互记录失败")
+
+    async def flush_logs(self, *action_ids: str) -> None:
+        """等待交互记录写入完成,之后对这些动作记录的反馈总能找到对应的交互.
+
+        Args:
+            *action_ids: 要等待的动作ID,不指定时等待所有尚未写完的记录
+        """
+        if action_ids:
+            futures = [self._pending_logs.get(action_id) for action_id in action_ids]
+        else:
+            futures = list(self._pending_logs.values())
+        for future in futures:
+            if future is not None:
+                await asyncio.wrap_future(future)
+
     async def _call_llm(self, messages: list[dict[str, Any]]) -> dict[str, Any]:
         """调用智谱AI API.
 
@@ -488,139 +702,403 @@ class SmartHomeAgent:
         Returns:
             API 响应
         """
-        api_key = self.API_KEY
-        if not api_key:
+        headers = self._auth_headers()
+        if headers is None:
             return {"error": "API Key 未设置,请在环境变量中设置 ZHIPU_API_KEY"}
 
-        headers = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json",
-        }
-
-        payload = {
-            "model": "glm-4-flash",
-            "messages": messages,
-            "tools": self.tools,
-            "tool_choice": "auto",
-            "temperature": 0.7,
-            "max_tokens": 2048,
-        }
+        body = self._build_body(messages)
 
         try:
             # 配置 HTTP 客户端,禁用代理以避免连接问题
-            async with httpx.AsyncClient(
-                timeout=30.0,
-                proxy=None,
-                limits=httpx.Limits(max_keepalive_connections=5, max_connections=10),
-            ) as client:
-                response = await client.post(self.API_URL, json=payload, headers=headers)
+            client = self._get_client()
+            response = await client.post(self.API_URL, content=body, headers=headers)
+            response.raise_for_status()
+            return orjson.loads(response.content)
+        except httpx.HTTPStatusError as e:
+            error_detail = e.response.text if e.response else "No response"
+            return {"error": f"API 请求失败: {e} - {error_detail}"}
+        except httpx.ConnectError as e:
+            return {"error": f"网络连接失败: {e}. 请检查网络连接或代理设置"}
+        except Exception as e:
+            return self._unexpected_error(e)
+
+    async def _call_llm_shared(
+        self, key: tuple[str, int], messages: list[dict[str, Any]]
+    ) -> dict[str, Any]:
+        """调用 LLM,同一键已有请求在进行时等待其结果而不重复请求.
+
+        Args:
+            key: 请求键 (规范化的用户输入, topology_version)
+            messages: 对话消息列表
+
+        Returns:
+            API 响应
+        """
+        # 任务只能在创建它的事件循环上等待,因此只在同一循环内共享
+        inflight_key = (key, asyncio.get_running_loop())
+        task = self._inflight.get(inflight_key)
+        if task is None:
+            task = asyncio.ensure_future(self._call_llm(messages))
+            self._inflight[inflight_key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(inflight_key, None))
+        # shield: 某个等待方被取消时不影响共享同一请求的其他调用方
+        return await asyncio.shield(task)
+
+    async def _call_llm_stream(
+        self,
+        messages: list[dict[str, Any]],
+        on_sentence: Callable[[str], None],
+        on_tool_call: ToolCallCallback | None = None,
+    ) -> dict[str, Any]:
+        """以流式 (SSE) 方式调用智谱AI API,文本回复按句回调输出.
+
+        Args:
+            messages: 消息列表
+            on_sentence: 每收到一个完整句子时调用的回调
+            on_tool_call: 可选回调; 每个工具调用的参数接收完整时立即调用
+
+        Returns:
+            与 _call_llm 相同结构的完整 API 响应
+        """
+        headers = self._auth_headers()
+        if headers is None:
+            return {"error": "API Key 未设置,请在环境变量中设置 ZHIPU_API_KEY"}
+
+        body = self._build_body(messages, stream=True)
+
+        try:
+            client = self._get_client()
+            async with client.stream(
+                "POST", self.API_URL, content=body, headers=headers
+            ) as response:
+                if response.is_error:
+                    await response.aread()
                 response.raise_for_status()
-                return response.json()
+                return await self._assemble_stream(
+                    response.aiter_lines(), on_sentence, on_tool_call
+                )
         except httpx.HTTPStatusError as e:
             error_detail = e.response.text if e.response else "No response"
             return {"error": f"API 请求失败: {e} - {error_detail}"}
         except httpx.ConnectError as e:
             return {"error": f"网络连接失败: {e}. 请检查网络连接或代理设置"}
         except Exception as e:
-            import traceback
+            return self._unexpected_error(e)
 
-            error_trace = traceback.format_exc()
-            return {"error": f"请求异常: {e}\n{error_trace}"}
+    async def _assemble_stream(
+        self,
+        lines: AsyncIterator[str],
+        on_sentence: Callable[[str], None],
+        on_tool_call: ToolCallCallback | None = None,
+    ) -> dict[str, Any]:
+        """将 SSE 数据行组装为完整响应,同时按句回调文本内容.
 
-    def _execute_tool_call(self, tool_name: str, arguments: dict[str, Any]) -> str:
-        """执行工具调用.
+        工具调用的参数拼接为合法 JSON 时即视为接收完整,立即通过 on_tool_call
+        通知调用方,使工具执行与后续内容的生成重叠.
+
+        Args:
+            lines: SSE 响应的文本行
+            on_sentence: 每收到一个完整句子时调用的回调
+            on_tool_call: 可选回调,参数为 (序号, 工具名称, 解析后的参数)
+
+        Returns:
+            与非流式接口相同结构的响应字典
+        """
+        content_parts: list[str] = []
+        pending = ""
+        tool_calls: dict[int, dict[str, Any]] = {}
+        dispatched: set[int] = set()
+
+        def dispatch_if_complete(index: int) -> None:
+            if on_tool_call is None or index in dispatched:
+                return
+            function = tool_calls[index]["function"]
+            # 参数末尾可能带有空白或换行
+            raw_arguments = function["arguments"].rstrip()
+            if raw_arguments and not raw_arguments.endswith("}"):
+                return
+            try:
+                arguments = _parse_arguments(raw_arguments)
+            except orjson.JSONDecodeError:
+                return
+            dispatched.add(index)
+            on_tool_call(index, function["name"], arguments)
+
+        async for line in lines:
+            if not line.startswith("data:"):
+                continue
+            data = line[5:].strip()
+            if data == "[DONE]":
+                break
+
+            delta = orjson.loads(data)["choices"][0].get("delta", {})
+
+            text = delta.get("content")
+            if text:
+                content_parts.append(text)
+                pending += text
+                end = _last_sentence_end(pending)
+                if end >= 0:
+                    on_sentence(pending[: end + 1])
+                    pending = pending[end + 1 :]
+
+            for position, fragment in enumerate(delta.get("tool_calls") or []):
+                index = fragment.get("index", position)
+                call = tool_calls.setdefault(
+                    index,
+                    {
+                        "id": fragment.get("id"),
+                        "type": "function",
+                        "function": {"name": "", "arguments": ""},
+                    },
+                )
+                function = fragment.get("function", {})
+                if function.get("name"):
+                    call["function"]["name"] = function["name"]
+                if function.get("arguments"):
+                    call["function"]["arguments"] += function["arguments"]
+                    dispatch_if_complete(index)
+
+        if pending:
+            on_sentence(pending)
+        for index in sorted(tool_calls):
+            dispatch_if_complete(index)
+
+        message: dict[str, Any] = {"role": "assistant"}
+        if content_parts:
+            message["content"] = "".join(content_parts)
+        if tool_calls:
+            message["tool_calls"] = [tool_calls[index] for index in sorted(tool_calls)]
+        return {"choices": [{"message": message}]}
+
+    def _match_fast_path(self, normalized_input: str) -> list[dict[str, Any]] | None:
+        """用规则匹配无歧义的简单指令 (如 "打开客厅灯"),命中时无需请求 LLM.
+
+        Args:
+            normalized_input: 去除首尾空白并转为小写的用户输入
+
+        Returns:
+            与 LLM 返回格式相同的工具调用列表,未命中返回 None
+        """
+        command = normalized_input.rstrip("。.!！")
+
+        bulk_tool = _FAST_PATH_BULK.get(command)
+        if bulk_tool is not None:
+            return [_tool_call(bulk_tool, {})]
+
+        for pattern, tools_by_type in _FAST_PATH_RULES:
+            match = pattern.fullmatch(command)
+            if match is None:
+                continue
+            device = self._resolve_device(match.group(1))
+            if device is None:
+                continue
+            device_id, device_type = device
+            tool_name = tools_by_type.get(device_type)
+            if tool_name is not None:
+                return [_tool_call(tool_name, {"device_id": device_id})]
+
+        return None
+
+    def _resolve_device(self, name: str) -> tuple[str, str] | None:
+        """按设备ID或设备名称查找设备.
+
+        Args:
+            name: 设备ID或名称 (如 "客厅灯")
+
+        Returns:
+            (设备ID, 设备类型),找不到返回 None
+        """
+        return self._device_index.get(name.lower())
+
+    def _build_device_index(self) -> dict[str, tuple[str, str]]:
+        """构建小写设备ID/设备名称到 (设备ID, 设备类型) 的索引.
+
+        Returns:
+            设备查找索引
+        """
+        index: dict[str, tuple[str, str]] = {}
+        for device_id, metadata in self.simulator.get_all_metadata().items():
+            entry = (device_id, metadata["device_type"])
+            index.setdefault(metadata["name"].lower(), entry)
+            index[device_id.lower()] = entry
+        return index
+
+    async def _execute_tool_call_after(
+        self,
+        previous: asyncio.Task[str] | None,
+        tool_name: str,
+        arguments: dict[str, Any],
+        context: dict[str, Any],
+    ) -> str:
+        """等待前一个工具调用结束后,在工作线程中执行本工具调用.
 
         Args:
+            previous: 前一个已开始的工具调用任务 (没有则为 None)
             tool_name: 工具名称
             arguments: 工具参数
+            context: 本次请求开始时捕获的上下文
 
         Returns:
             执行结果
         """
-        # Apply learned preferences before executing
-        context = self._capture_context()
-        adjusted_args, preference_message = self._apply_preferences(tool_name, arguments, context)
+        if previous is not None:
+            await asyncio.wait([previous])
+        results = await asyncio.to_thread(
+            self._execute_tool_calls, [(tool_name, arguments)], context
+        )
+        return results[0]
 
-        if preference_message:
-            # Log the preference adjustment
-            result_messages = [preference_message]
-        else:
-            result_messages = []
+    async def _finish_calls(
+        self,
+        calls: list[tuple[str, dict[str, Any]]],
+        actions: list[dict[str, Any]],
+        started: tuple[list[dict[str, Any]], list[str]],
+        context: dict[str, Any],
+    ) -> list[str]:
+        """补充执行流式接收期间未能提前开始的工具调用,并按原顺序合并结果.
 
-        try:
-            result = None
-            # ========== 查询工具 (QUERY) ==========
-            if tool_name == "get_device_state":
-                device_id = arguments.get("device_id")
-                details = self.simulator.get_device_details(device_id)
-                if details:
-                    result = f"设备 {device_id} 状态:\n{json.dumps(details, ensure_ascii=False, indent=2)}"
-                else:
-                    result = f"设备 {device_id} 不存在"
-            elif tool_name == "get_all_device_statuses":
-                statuses = self.simulator.get_all_statuses()
-                result = json.dumps(statuses, ensure_ascii=False, indent=2)
-
-            # ========== 控制工具 (COMMAND) ==========
-            elif tool_name == "turn_on_light":
-                result = self.simulator.turn_on_light(**adjusted_args)
-            elif tool_name == "turn_off_light":
-                result = self.simulator.turn_off_light(**adjusted_args)
-            elif tool_name == "set_light_brightness":
-                result = self.simulator.set_light_brightness(**adjusted_args)
-            elif tool_name == "set_light_color":
-                result = self.simulator.set_light_color(**adjusted_args)
-            elif tool_name == "set_temperature":
-                result = self.simulator.set_temperature(**adjusted_args)
-            elif tool_name == "turn_on_fan":
-                result = self.simulator.turn_on_fan(**adjusted_args)
-            elif tool_name == "turn_off_fan":
-                result = self.simulator.turn_off_fan(**adjusted_args)
-            elif tool_name == "set_fan_speed":
-                result = self.simulator.set_fan_speed(**adjusted_args)
-            elif tool_name == "open_curtain":
-                result = self.simulator.open_curtain(**adjusted_args)
-            elif tool_name == "close_curtain":
-                result = self.simulator.close_curtain(**adjusted_args)
-            elif tool_name == "lock_door":
-                result = self.simulator.lock_door(**adjusted_args)
-            elif tool_name == "unlock_door":
-                result = self.simulator.unlock_door(**adjusted_args)
-            elif tool_name == "turn_off_all_lights":
-                results = self.simulator.turn_off_all_lights()
-                result = "\n".join(results)
-            elif tool_name == "turn_on_all_lights":
-                results = self.simulator.turn_on_all_lights()
-                result = "\n".join(results)
-            elif tool_name == "lock_all_doors":
-                results = self.simulator.lock_all_doors()
-                result = "\n".join(results)
-            elif tool_name == "unlock_all_doors":
-                results = self.simulator.unlock_all_doors()
-                result = "\n".join(results)
-            elif tool_name == "close_all_curtains":
-                results = self.simulator.close_all_curtains()
-                result = "\n".join(results)
-            elif tool_name == "open_all_curtains":
-                results = self.simulator.open_all_curtains()
-                result = "\n".join(results)
+        Args:
+            calls: 完整响应中的 (工具名称, 工具参数) 列表
+            actions: 与 calls 对应的动作列表
+            started: 已提前执行的 (动作列表, 执行结果),顺序与 calls 一致
+            context: 本次请求开始时捕获的上下文
+
+        Returns:
+            每个工具调用的执行结果
+        """
+        started_actions, started_results = started
+        results: dict[int, str] = {}
+        missing: list[int] = []
+        position = 0
+        for index, action in enumerate(actions):
+            if position < len(started_actions) and started_actions[position] == action:
+                results[index] = started_results[position]
+                position += 1
             else:
-                return f"错误: 未知的工具 '{tool_name}'"
+                missing.append(index)
 
-            # Combine preference message with result
-            if result_messages:
-                result_messages.append(result)
-                return "\n".join(result_messages)
-            return result
+        if missing:
+            missing_results = await asyncio.to_thread(
+                self._execute_tool_calls, [calls[index] for index in missing], context
+            )
+            results.update(zip(missing, missing_results, strict=True))
+        return [results[index] for index in range(len(calls))]
+
+    def _execute_tool_calls(
+        self, calls: list[tuple[str, dict[str, Any]]], context: dict[str, Any]
+    ) -> list[str]:
+        """按顺序执行一组工具调用.
+
+        Args:
+            calls: (工具名称, 工具参数) 列表
+            context: 本次请求开始时捕获的上下文
+
+        Returns:
+            每个工具调用的执行结果
+        """
+        # 持锁避免并发请求同时修改模拟器; 同一轮的多个工具调用只在结束时保存一次设备状态
+        with self._tool_lock, self.simulator.batch_saves():
+            return [
+                self._execute_tool_call(tool_name, arguments, context)
+                for tool_name, arguments in calls
+            ]
+
+    def _build_tool_handlers(self) -> dict[str, Callable[[dict[str, Any]], str]]:
+        """构建工具名称到处理函数的分发表.
+
+        Returns:
+            工具名称 -> 接收工具参数并返回结果消息的函数
+        """
+        handlers: dict[str, Callable[[dict[str, Any]], str]] = {
+            # ========== 查询工具 (QUERY) ==========
+            "get_device_state": self._get_device_state,
+            "get_all_device_statuses": self._get_all_device_statuses,
+        }
+
+        # ========== 控制工具 (COMMAND) ==========
+        for tool_name in _DEVICE_TOOLS:
+            handlers[tool_name] = _device_tool(getattr(self.simulator, tool_name))
+        for tool_name in _BULK_TOOLS:
+            handlers[tool_name] = _bulk_tool(getattr(self.simulator, tool_name))
+
+        return handlers
+
+    def _build_validators(self) -> dict[str, Callable[[dict[str, Any]], str | None]]:
+        """按当前工具定义预编译各工具的参数校验函数.
+
+        Returns:
+            工具名称 -> 参数校验函数
+        """
+        return {
+            tool["function"]["name"]: _compile_validator(tool["function"]["parameters"])
+            for tool in self.tools
+        }
+
+    def _get_device_state(self, arguments: dict[str, Any]) -> str:
+        """查询单个设备的状态."""
+        device_id = arguments.get("device_id")
+        details = self.simulator.get_device_details(device_id)
+        if details:
+            state = orjson.dumps(details, option=orjson.OPT_INDENT_2).decode()
+            return f"设备 {device_id} 状态:\n{state}"
+        return f"设备 {device_id} 不存在"
+
+    def _get_all_device_statuses(self, arguments: dict[str, Any]) -> str:
+        """查询所有设备的状态."""
+        statuses = self.simulator.get_all_statuses()
+        return orjson.dumps(statuses, option=orjson.OPT_INDENT_2).decode()
+
+    def _execute_tool_call(
+        self, tool_name: str, arguments: dict[str, Any], context: dict[str, Any]
+    ) -> str:
+        """执行工具调用.
+
+        Args:
+            tool_name: 工具名称
+            arguments: 工具参数
+            context: 本次请求开始时捕获的上下文 (用于应用偏好)
+
+        Returns:
+            执行结果
+        """
+        handler = self._tool_handlers.get(tool_name)
+        if handler is None:
+            return f"错误: 未知的工具 '{tool_name}'"
+
+        # LLM 偶尔以设备名称代替设备ID,执行前映射回设备ID
+        device_ref = arguments.get("device_id")
+        if isinstance(device_ref, str):
+            device = self._device_index.get(device_ref.lower())
+            if device is not None and device[0] != device_ref:
+                arguments = {**arguments, "device_id": device[0]}
+
+        # 参数不符合工具定义时直接拒绝,不再交给模拟器
+        error = self._validators[tool_name](arguments)
+        if error is not None:
+            return f"参数错误: {error}"
+
+        # Apply learned preferences before executing
+        adjusted_args, preference_message = self._apply_preferences(tool_name, arguments, context)
 
+        try:
+            result = handler(adjusted_args)
         except Exception as e:
             return f"执行失败: {e}"
 
-    async def process(self, user_input: str) -> dict[str, Any]:
+        # Combine preference message with result
+        if preference_message:
+            return f"{preference_message}\n{result}"
+        return result
+
+    async def process(
+        self, user_input: str, on_sentence: Callable[[str], None] | None = None
+    ) -> dict[str, Any]:
         """处理用户输入.
 
         Args:
             user_input: 用户自然语言输入
+            on_sentence: 可选回调; 提供时以流式方式请求 LLM,文本回复每完成一句即回调
 
         Returns:
             处理结果字典,包含:
@@ -629,31 +1107,65 @@ class SmartHomeAgent:
                 - action_id: 动作ID (用于反馈)
                 - actions_taken: 执行的动作列表
         """
-        # Generate action ID
-        action_id = f"{datetime.now().strftime('%Y%m%d%H%M%S')}_{hash(user_input) % 10000:04d}"
+        # action_id 与上下文时间取自同一次时钟读取
+        now_ns = time.time_ns()
+        action_id = f"{now_ns:x}_{next(_action_counter):04x}"
 
         # Capture context before processing
-        context = self._capture_context()
-
-        messages = [
-            {"role": "system", "content": self._build_system_prompt()},
-            {"role": "user", "content": user_input},
-        ]
-
-        response = await self._call_llm(messages)
+        context = self._capture_context(datetime.fromtimestamp(now_ns / 1e9))
+
+        messages = [self._build_system_message(), {"role": "user", "content": user_input}]
+
+        # 流式模式下工具调用在参数接收完整后即按顺序在后台开始执行
+        started_calls: dict[int, asyncio.Task[str]] = {}
+        started_actions: dict[int, dict[str, Any]] = {}
+
+        def start_tool_call(index: int, tool_name: str, arguments: dict[str, Any]) -> None:
+            previous = next(reversed(started_calls.values()), None)
+            started_actions[index] = {"tool": tool_name, "arguments": arguments}
+            started_calls[index] = asyncio.create_task(
+                self._execute_tool_call_after(previous, tool_name, arguments, context)
+            )
+
+        async def finish_started_calls() -> tuple[list[dict[str, Any]], list[str]]:
+            # 响应出错时已开始的工具调用仍会修改设备,等待其完成并如实返回与记录
+            indexes = sorted(started_calls)
+            results = await asyncio.gather(*(started_calls[index] for index in indexes))
+            return [started_actions[index] for index in indexes], list(results)
+
+        # 简单指令由规则直接匹配; 相同指令 (设备集合未变) 复用之前 LLM 给出的工具调用
+        normalized_input = user_input.strip().lower()
+        cache_key = (normalized_input, self._topology_version)
+        cached_tool_calls = self._match_fast_path(normalized_input)
+        if cached_tool_calls is None:
+            cached_tool_calls = self._get_cached_response(cache_key)
+
+        if cached_tool_calls is not None:
+            cached_message = {"role": "assistant", "tool_calls": cached_tool_calls}
+            response = {"choices": [{"message": cached_message}]}
+        elif on_sentence is None:
+            response = await self._call_llm_shared(cache_key, messages)
+        else:
+            response = await self._call_llm_stream(messages, on_sentence, start_tool_call)
 
         if "error" in response:
+            actions_taken, results = await finish_started_calls()
+            message = f"❌ {response['error']}"
+            agent_action: dict[str, Any] = {"error": response["error"]}
+            if actions_taken:
+                message = "\n".join([message, *results])
+                agent_action.update(actions=actions_taken, result="\n".join(results))
             error_result = {
                 "success": False,
-                "message": f"❌ {response['error']}",
+                "message": message,
                 "action_id": action_id,
-                "actions_taken": [],
+                "actions_taken": actions_taken,
             }
             # Log failed interaction
             if self.enable_logging and self.logger:
-                self.logger.log_interaction(
+                self._log_interaction(
                     user_command=user_input,
-                    agent_action={"error": response["error"]},
+                    agent_action=agent_action,
                     context=context,
                     action_id=action_id,
                 )
@@ -674,7 +1186,7 @@ class SmartHomeAgent:
                 }
                 # Log interaction with no tool calls
                 if self.enable_logging and self.logger:
-                    self.logger.log_interaction(
+                    self._log_interaction(
                         user_command=user_input,
                         agent_action={"response": text_response},
                         context=context,
@@ -683,18 +1195,25 @@ class SmartHomeAgent:
                 return result
 
             # 执行所有工具调用
-            actions_taken = []
-            results = []
-            for tool_call in assistant_message["tool_calls"]:
-                function = tool_call["function"]
-                tool_name = function["name"]
-                arguments = json.loads(function["arguments"])
-
-                action_record = {"tool": tool_name, "arguments": arguments}
-                actions_taken.append(action_record)
-
-                result = self._execute_tool_call(tool_name, arguments)
-                results.append(result)
+            calls = [
+                (
+                    tool_call["function"]["name"],
+                    _parse_arguments(tool_call["function"]["arguments"]),
+                )
+                for tool_call in assistant_message["tool_calls"]
+            ]
+            actions_taken = [
+                {"tool": tool_name, "arguments": arguments} for tool_name, arguments in calls
+            ]
+
+            # 在工作线程中执行,不阻塞事件循环; 同一请求的调用可能作用于同一设备,
+            # 因此保持顺序执行,并用锁避免并发请求同时修改模拟器
+            if started_calls:
+                results = await self._finish_calls(
+                    calls, actions_taken, await finish_started_calls(), context
+                )
+            else:
+                results = await asyncio.to_thread(self._execute_tool_calls, calls, context)
 
             result_message = "\n".join(results)
             result = {
@@ -704,9 +1223,15 @@ class SmartHomeAgent:
                 "actions_taken": actions_taken,
             }
 
+            self._store_cached_response(
+                cache_key,
+                action_id,
+                assistant_message["tool_calls"] if cached_tool_calls is None else None,
+            )
+
             # Log interaction with tool calls
             if self.enable_logging and self.logger:
-                self.logger.log_interaction(
+                self._log_interaction(
                     user_command=user_input,
                     agent_action={"actions": actions_taken, "result": result_message},
                     context=context,
@@ -714,30 +1239,95 @@ class SmartHomeAgent:
                 )
 
             return result
-        except (KeyError, IndexError, json.JSONDecodeError) as e:
+        except (KeyError, IndexError, TypeError, AttributeError, orjson.JSONDecodeError) as e:
+            actions_taken, results = await finish_started_calls()
+            message = f"❌ 解析响应失败: {e}"
+            agent_action = {"error": str(e)}
+            if actions_taken:
+                message = "\n".join([message, *results])
+                agent_action.update(actions=actions_taken, result="\n".join(results))
             error_result = {
                 "success": False,
-                "message": f"❌ 解析响应失败: {e}",
+                "message": message,
                 "action_id": action_id,
-                "actions_taken": [],
+                "actions_taken": actions_taken,
             }
             # Log failed interaction
             if self.enable_logging and self.logger:
-                self.logger.log_interaction(
+                self._log_interaction(
                     user_command=user_input,
-                    agent_action={"error": str(e)},
+                    agent_action=agent_action,
                     context=context,
                     action_id=action_id,
                 )
             return error_result
 
-    def _capture_context(self) -> dict[str, Any]:
+    def discard_cached_response(self, action_id: str) -> bool:
+        """用户否定某个动作后,淘汰该动作所用的工具调用缓存,下次相同指令重新请求 LLM.
+
+        Args:
+            action_id: process() 返回的动作ID
+
+        Returns:
+            是否淘汰了缓存项
+        """
+        with self._cache_lock:
+            cache_key = self._cached_actions.pop(action_id, None)
+            if cache_key is None:
+                return False
+            return self._response_cache.pop(cache_key, None) is not None
+
+    def _get_cached_response(self, cache_key: tuple[str, int]) -> list[dict[str, Any]] | None:
+        """查找缓存的工具调用,命中时将其标记为最近使用.
+
+        Args:
+            cache_key: (规范化的用户输入, topology_version)
+
+        Returns:
+            缓存的工具调用,未命中时为 None
+        """
+        with self._cache_lock:
+            tool_calls = self._response_cache.get(cache_key)
+            if tool_calls is not None:
+                self._response_cache.move_to_end(cache_key)
+            return tool_calls
+
+    def _store_cached_response(
+        self,
+        cache_key: tuple[str, int],
+        action_id: str,
+        tool_calls: list[dict[str, Any]] | None,
+    ) -> None:
+        """写入 LLM 给出的工具调用,并记录该动作所用的缓存键.
+
+        LLM 调用期间另一个请求可能已写入同一键,此时直接覆盖为较新的结果.
+
+        Args:
+            cache_key: (规范化的用户输入, topology_version)
+            action_id: process() 的动作ID
+            tool_calls: 需要写入的工具调用; 为 None 时只记录动作 (如复用了缓存)
+        """
+        with self._cache_lock:
+            if tool_calls is not None:
+                self._response_cache[cache_key] = tool_calls
+                if len(self._response_cache) > self.RESPONSE_CACHE_SIZE:
+                    self._response_cache.popitem(last=False)
+            if cache_key in self._response_cache:
+                self._cached_actions[action_id] = cache_key
+                if len(self._cached_actions) > self.RESPONSE_CACHE_SIZE:
+                    self._cached_actions.popitem(last=False)
+
+    def _capture_context(self, now: datetime | None = None) -> dict[str, Any]:
         """Capture the current context for logging.
 
+        Args:
+            now: Time of the request; defaults to the current time
+
         Returns:
             Context dictionary with time and device states
         """
-        now = datetime.now()
+        if now is None:
+            now = datetime.now()
         return {
             "timestamp": now.isoformat(),
             "time_of_day": now.hour,
@@ -748,21 +1338,17 @@ class SmartHomeAgent:
     def process_sync(self, user_input: str) -> dict[str, Any]:
         """同步版本的处理方法.
 
+        在常驻后台事件循环上运行 process(),多次调用复用同一 HTTP 连接池;
+        不再使用时调用 close_sync() 关闭连接.
+
         Args:
             user_input: 用户自然语言输入
 
         Returns:
             处理结果字典
         """
-        import asyncio
-
-        try:
-            loop = asyncio.get_event_loop()
-        except RuntimeError:
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-
-        return loop.run_until_complete(self.process(user_input))
+        future = asyncio.run_coroutine_threadsafe(self.process(user_input), _get_sync_loop())
+        return future.result()
 
     # ========== 偏好学习相关方法 ==========
 
@@ -779,7 +1365,7 @@ class SmartHomeAgent:
         Returns:
             Tuple of (adjusted_arguments, preference_message)
         """
-        if self.preference_model is None:
+        if self.preference_model is None or self.preference_model.is_empty:
             return arguments, None
 
         return self.preference_model.adjust_arguments(tool_name, arguments, context)
@@ -822,20 +1408,9 @@ class SmartHomeAgent:
             return False
 
         try:
-            import sqlite3
-
-            with sqlite3.connect(self.preference_model.db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute(
-                    """
-                    SELECT COUNT(*) FROM interaction_logs
-                    WHERE user_feedback IS NOT NULL
-                    """
-                )
-                count = cursor.fetchone()[0]
-
-                # Retrain after every 10 feedback entries
-                return count >= 10 and count % 10 == 0
-
+            count = self.logger.get_feedback_count()
         except sqlite3.Error:
             return False
+
+        # Retrain after every 10 feedback entries
+        return count >= 10 and count % 10 == 0
@@ -1,9 +1,13 @@
 """Device State Persistence - Save and load device states to/from JSON."""
 
-import json
+import os
+import shutil
+from collections.abc import Callable
 from pathlib import Path
 from typing import Any
 
+import orjson
+
 from smarthome_mock_ai.devices import (
     Curtain,
     DeviceType,
@@ -32,6 +36,8 @@ class DeviceStateManager:
             state_file = str(data_dir / "devices.json")
 
         self.state_file = state_file
+        # Last content written to state_file, used to skip rewriting unchanged states
+        self._last_saved: bytes | None = None
 
     def save_states(self, devices: dict[str, SmartDevice]) -> bool:
         """Save device states to JSON file.
@@ -52,8 +58,16 @@ class DeviceStateManager:
                     "state": status.state,
                 }
 
-            with open(self.state_file, "w", encoding="utf-8") as f:
-                json.dump(states, f, ensure_ascii=False, indent=2)
+            payload = orjson.dumps(states, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+            if payload == self._last_saved:
+                return True
+
+            # Write to a temporary file and rename it so a crash never leaves a partial file
+            tmp_file = f"{self.state_file}.tmp"
+            with open(tmp_file, "wb") as f:
+                f.write(payload)
+            os.replace(tmp_file, self.state_file)
+            self._last_saved = payload
 
             return True
         except (IOError, OSError) as e:
@@ -67,11 +81,11 @@ class DeviceStateManager:
             Dictionary of device_id to state data, or None if file doesn't exist
         """
         try:
-            with open(self.state_file, encoding="utf-8") as f:
-                return json.load(f)
+            with open(self.state_file, "rb") as f:
+                return orjson.loads(f.read())
         except FileNotFoundError:
             return None
-        except (IOError, OSError, json.JSONDecodeError) as e:
+        except (IOError, OSError, orjson.JSONDecodeError) as e:
             print(f"Warning: Failed to load device states: {e}")
             return None
 
@@ -98,16 +112,9 @@ class DeviceStateManager:
 
             try:
                 # Apply state based on device type
-                if isinstance(device, Light):
-                    self._apply_light_state(device, state)
-                elif isinstance(device, Thermostat):
-                    self._apply_thermostat_state(device, state)
-                elif isinstance(device, Fan):
-                    self._apply_fan_state(device, state)
-                elif isinstance(device, Curtain):
-                    self._apply_curtain_state(device, state)
-                elif isinstance(device, Door):
-                    self._apply_door_state(device, state)
+                handler = self._handler_for(type(device))
+                if handler is not None:
+                    handler(self, device, state)
 
                 updated_count += 1
             except (ValueError, KeyError) as e:
@@ -155,6 +162,27 @@ class DeviceStateManager:
             device.unlock()
         # Note: door open/close is not persisted as it requires unlock first
 
+    # Exact device class -> state handler; subclasses are resolved via _handler_for
+    _HANDLERS: dict[type, Callable[..., None]] = {
+        Light: _apply_light_state,
+        Thermostat: _apply_thermostat_state,
+        Fan: _apply_fan_state,
+        Curtain: _apply_curtain_state,
+        Door: _apply_door_state,
+    }
+
+    @classmethod
+    def _handler_for(cls, device_cls: type) -> Callable[..., None] | None:
+        """Look up the state handler for a device class, falling back to its bases."""
+        handler = cls._HANDLERS.get(device_cls)
+        if handler is None:
+            for base in device_cls.__mro__[1:]:
+                handler = cls._HANDLERS.get(base)
+                if handler is not None:
+                    cls._HANDLERS[device_cls] = handler
+                    break
+        return handler
+
     def backup_states(self) -> str | None:
         """Create a backup of current states file.
 
@@ -163,9 +191,7 @@ class DeviceStateManager:
         """
         try:
             backup_path = f"{self.state_file}.backup"
-            with open(self.state_file, encoding="utf-8") as src:
-                with open(backup_path, "w", encoding="utf-8") as dst:
-                    dst.write(src.read())
+            shutil.copyfile(self.state_file, backup_path)
             return backup_path
         except (IOError, OSError):
             return None
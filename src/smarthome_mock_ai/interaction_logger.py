@@ -2,12 +2,17 @@
 
 import json
 import os
+import threading
 from datetime import datetime
 from pathlib import Path
 from typing import Any
 
+import orjson
 import sqlite3
 
+# Feedback count query; reused from sqlite3's statement cache on the persistent connection
+_FEEDBACK_COUNT_SQL = "SELECT n FROM interaction_counts WHERE name = 'feedback'"
+
 
 class InteractionLogger:
     """Logger for storing interaction history and user feedback."""
@@ -25,6 +30,9 @@ class InteractionLogger:
             db_path = str(data_dir / "history.db")
 
         self.db_path = db_path
+        # Persistent read-only connection for the feedback count, opened on first use
+        self._read_conn: sqlite3.Connection | None = None
+        self._read_lock = threading.Lock()
         self._init_database()
 
     def _init_database(self) -> None:
@@ -46,8 +54,72 @@ class InteractionLogger:
                 )
             """
             )
+            # Keep the feedback count up to date with triggers instead of scanning with COUNT(*)
+            cursor.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS interaction_counts (
+                    name TEXT PRIMARY KEY,
+                    n INTEGER NOT NULL
+                );
+                INSERT OR IGNORE INTO interaction_counts (name, n)
+                SELECT 'feedback', COUNT(*) FROM interaction_logs WHERE user_feedback IS NOT NULL;
+
+                CREATE TRIGGER IF NOT EXISTS interaction_feedback_insert
+                AFTER INSERT ON interaction_logs WHEN NEW.user_feedback IS NOT NULL
+                BEGIN
+                    UPDATE interaction_counts SET n = n + 1 WHERE name = 'feedback';
+                END;
+
+                CREATE TRIGGER IF NOT EXISTS interaction_feedback_update
+                AFTER UPDATE OF user_feedback ON interaction_logs
+                WHEN (NEW.user_feedback IS NULL) != (OLD.user_feedback IS NULL)
+                BEGIN
+                    UPDATE interaction_counts
+                    SET n = n + (CASE WHEN NEW.user_feedback IS NULL THEN -1 ELSE 1 END)
+                    WHERE name = 'feedback';
+                END;
+
+                CREATE TRIGGER IF NOT EXISTS interaction_feedback_delete
+                AFTER DELETE ON interaction_logs WHEN OLD.user_feedback IS NOT NULL
+                BEGIN
+                    UPDATE interaction_counts SET n = n - 1 WHERE name = 'feedback';
+                END;
+                """
+            )
+            # WAL lets the read connection run alongside background writes
+            cursor.execute("PRAGMA journal_mode=WAL")
             conn.commit()
 
+    def _get_read_connection(self) -> sqlite3.Connection:
+        """Get the persistent connection used for lightweight reads.
+
+        Returns:
+            sqlite3.Connection shared across threads (guarded by _read_lock)
+        """
+        if self._read_conn is None:
+            conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            conn.execute("PRAGMA busy_timeout=5000")
+            conn.execute("PRAGMA query_only=ON")
+            self._read_conn = conn
+        return self._read_conn
+
+    def get_feedback_count(self) -> int:
+        """Get the number of interactions that have received feedback.
+
+        Returns:
+            Number of interactions with user feedback
+        """
+        with self._read_lock:
+            row = self._get_read_connection().execute(_FEEDBACK_COUNT_SQL).fetchone()
+        return row[0] if row else 0
+
+    def close(self) -> None:
+        """Close the persistent read connection, if open."""
+        with self._read_lock:
+            if self._read_conn is not None:
+                self._read_conn.close()
+                self._read_conn = None
+
     def log_interaction(
         self,
         user_command: str,
@@ -84,9 +156,9 @@ class InteractionLogger:
                 """,
                 (
                     timestamp,
-                    json.dumps(context, ensure_ascii=False),
+                    orjson.dumps(context, option=orjson.OPT_NON_STR_KEYS).decode(),
                     user_command,
-                    json.dumps(agent_action, ensure_ascii=False),
+                    orjson.dumps(agent_action, option=orjson.OPT_NON_STR_KEYS).decode(),
                     action_id,
                 ),
             )
@@ -125,6 +197,35 @@ class InteractionLogger:
             conn.commit()
             return cursor.rowcount > 0
 
+    def record_feedback_batch(
+        self,
+        entries: list[tuple[str, int, str | None]],
+    ) -> int:
+        """Record feedback for several interactions in a single transaction.
+
+        Args:
+            entries: List of (action_id, feedback, corrected_command) tuples
+
+        Returns:
+            Number of interactions updated
+        """
+        for _, feedback, _ in entries:
+            if feedback not in (1, -1):
+                raise ValueError("Feedback must be either 1 (good) or -1 (bad)")
+
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.executemany(
+                """
+                UPDATE interaction_logs
+                SET user_feedback = ?, corrected_command = ?
+                WHERE action_id = ?
+                """,
+                [(feedback, corrected, action_id) for action_id, feedback, corrected in entries],
+            )
+            conn.commit()
+            return cursor.rowcount
+
     def get_interaction_by_action_id(self, action_id: str) -> dict[str, Any] | None:
         """Retrieve an interaction by its action ID.
 
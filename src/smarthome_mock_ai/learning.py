@@ -1,12 +1,21 @@
 """Preference Learning Module - Learn user habits from interaction history."""
 
+import heapq
 import json
+import re
 from collections import defaultdict
 from datetime import datetime
+from pathlib import Path
 from typing import Any
 
+import orjson
 import sqlite3
 
+from smarthome_mock_ai.interaction_logger import get_interaction_logger
+
+# 纠正指令中的温度 (例如: "24度", "24°C")
+_TEMPERATURE_RE = re.compile(r"(\d+\.?\d*)\s*[度°C]")
+
 
 class PreferenceModel:
     """Learn and predict user preferences based on context."""
@@ -35,7 +44,6 @@ class PreferenceModel:
             db_path: Path to SQLite database. If None, uses default.
         """
         if db_path is None:
-            from smarthome_mock_ai.interaction_logger import get_interaction_logger
             logger = get_interaction_logger()
             self.db_path = logger.db_path
         else:
@@ -54,6 +62,11 @@ class PreferenceModel:
         # Minimum confidence threshold for overriding
         self.min_confidence = 2
 
+    @property
+    def is_empty(self) -> bool:
+        """Whether the model has not learned any preferences yet."""
+        return not self.confidence
+
     def _get_time_period(self, hour: int | None = None) -> str:
         """Get the time period for a given hour.
 
@@ -138,8 +151,8 @@ class PreferenceModel:
             stats: Statistics dictionary to update
         """
         try:
-            agent_action = json.loads(interaction["agent_action"])
-            context = json.loads(interaction["context"])
+            agent_action = orjson.loads(interaction["agent_action"])
+            context = orjson.loads(interaction["context"])
 
             # Extract corrections from feedback
             feedback = interaction["user_feedback"]
@@ -151,7 +164,7 @@ class PreferenceModel:
                 # Positive feedback - reinforce the action
                 self._reinforce_action(agent_action, context, stats)
 
-        except (json.JSONDecodeError, KeyError):
+        except (orjson.JSONDecodeError, KeyError):
             pass  # Skip malformed interactions
 
     def _learn_from_correction(
@@ -165,11 +178,8 @@ class PreferenceModel:
             context: Context at time of interaction
             stats: Statistics dictionary to update
         """
-        # Try to extract parameter values from the correction
-        import re
-
         # Look for temperature corrections (e.g., "24度", "24°C")
-        temp_match = re.search(r"(\d+\.?\d*)\s*[度°C]", correction)
+        temp_match = _TEMPERATURE_RE.search(correction)
         if temp_match:
             corrected_temp = float(temp_match.group(1))
             context_key = self._get_context_key(context)
@@ -339,10 +349,10 @@ class PreferenceModel:
                 prefs = tool_prefs[context_key]
                 confs = tool_confs[context_key]
 
-                sorted_prefs = sorted(prefs.items(), key=lambda x: x[1], reverse=True)[:3]
+                top_prefs = heapq.nlargest(3, prefs.items(), key=lambda x: x[1])
 
                 top_values = []
-                for value, weight in sorted_prefs:
+                for value, weight in top_prefs:
                     top_values.append({
                         "value": value,
                         "weight": weight,
@@ -367,8 +377,6 @@ class PreferenceModel:
             Path to saved file
         """
         if filepath is None:
-            from pathlib import Path
-
             data_dir = Path(__file__).parent.parent.parent / "data"
             data_dir.mkdir(parents=True, exist_ok=True)
             filepath = str(data_dir / "preferences.json")
@@ -394,8 +402,6 @@ class PreferenceModel:
             True if loaded successfully, False otherwise
         """
         if filepath is None:
-            from pathlib import Path
-
             data_dir = Path(__file__).parent.parent.parent / "data"
             filepath = str(data_dir / "preferences.json")
 
@@ -1,5 +1,7 @@
 """智能家居模拟器 - 动态设备注册和管理系统."""
 
+import contextlib
+from collections.abc import Iterator
 from typing import Any
 
 from smarthome_mock_ai.device_persistence import DeviceStateManager, get_device_state_manager
@@ -25,8 +27,14 @@ class HomeSimulator:
             state_file: Optional path to state file (defaults to data/devices.json)
         """
         self.devices: dict[str, SmartDevice] = {}
+        # 设备集合版本号,注册/注销设备时递增,供调用方判断缓存是否失效
+        self.topology_version = 0
+        self._devices_by_type: tuple[int, dict[str, list[str]]] | None = None
         self.persist_state = persist_state
         self.state_manager = get_device_state_manager(state_file) if persist_state else None
+        # batch_saves 嵌套深度及期间是否有待保存的状态变更
+        self._batch_depth = 0
+        self._save_pending = False
         # Note: No longer calling _setup_default_devices here
         # Devices must be registered via register_device() method
         self._load_states()
@@ -50,6 +58,7 @@ class HomeSimulator:
             raise ValueError(msg)
 
         self.devices[device.device_id] = device
+        self.topology_version += 1
         self._save_after_action()
         return device.device_id
 
@@ -66,6 +75,7 @@ class HomeSimulator:
             return False
 
         del self.devices[device_id]
+        self.topology_version += 1
         self._save_after_action()
         return True
 
@@ -113,6 +123,21 @@ class HomeSimulator:
         """列出所有设备ID."""
         return list(self.devices.keys())
 
+    def group_devices_by_type(self) -> dict[str, list[str]]:
+        """按设备类型分组所有设备ID.
+
+        结果在设备集合变化前缓存复用,调用方不应修改返回的字典或列表.
+
+        Returns:
+            设备类型 (light, thermostat, ...) -> 设备ID列表
+        """
+        if self._devices_by_type is None or self._devices_by_type[0] != self.topology_version:
+            grouped: dict[str, list[str]] = {}
+            for device_id, device in self.devices.items():
+                grouped.setdefault(device.device_type.value, []).append(device_id)
+            self._devices_by_type = (self.topology_version, grouped)
+        return self._devices_by_type[1]
+
     def list_devices_by_type(self, device_type: str) -> list[str]:
         """按类型列出设备ID.
 
@@ -187,7 +212,26 @@ class HomeSimulator:
     def _save_after_action(self) -> None:
         """Save states after an action (internal method)."""
         if self.persist_state:
-            self.save_states()
+            if self._batch_depth:
+                self._save_pending = True
+            else:
+                self.save_states()
+
+    @contextlib.contextmanager
+    def batch_saves(self) -> Iterator[None]:
+        """合并上下文内所有操作的状态保存,退出时最多写入一次文件.
+
+        Yields:
+            None
+        """
+        self._batch_depth += 1
+        try:
+            yield
+        finally:
+            self._batch_depth -= 1
+            if self._batch_depth == 0 and self._save_pending:
+                self._save_pending = False
+                self.save_states()
 
     # ========== 便捷操作方法 ==========
 
@@ -392,62 +436,69 @@ class HomeSimulator:
     def turn_off_all_lights(self) -> list[str]:
         """关闭所有灯光."""
         results = []
-        for device_id in self.devices:
-            device = self.devices[device_id]
-            if isinstance(device, Light):
-                results.append(self.turn_off_light(device_id))
+        with self.batch_saves():
+            for device_id in self.devices:
+                device = self.devices[device_id]
+                if isinstance(device, Light):
+                    results.append(self.turn_off_light(device_id))
         return results
 
     def turn_on_all_lights(self) -> list[str]:
         """打开所有灯光."""
         results = []
-        for device_id in self.devices:
-            device = self.devices[device_id]
-            if isinstance(device, Light):
-                results.append(self.turn_on_light(device_id))
+        with self.batch_saves():
+            for device_id in self.devices:
+                device = self.devices[device_id]
+                if isinstance(device, Light):
+                    results.append(self.turn_on_light(device_id))
         return results
 
     def lock_all_doors(self) -> list[str]:
         """锁定所有门."""
         results = []
-        for device_id in self.devices:
-            device = self.devices[device_id]
-            if isinstance(device, Door):
-                results.append(self.lock_door(device_id))
+        with self.batch_saves():
+            for device_id in self.devices:
+                device = self.devices[device_id]
+                if isinstance(device, Door):
+                    results.append(self.lock_door(device_id))
         return results
 
     def unlock_all_doors(self) -> list[str]:
         """解锁所有门."""
         results = []
-        for device_id in self.devices:
-            device = self.devices[device_id]
-            if isinstance(device, Door):
-                results.append(self.unlock_door(device_id))
+        with self.batch_saves():
+            for device_id in self.devices:
+                device = self.devices[device_id]
+                if isinstance(device, Door):
+                    results.append(self.unlock_door(device_id))
         return results
 
     def close_all_curtains(self) -> list[str]:
         """关闭所有窗帘."""
         results = []
-        for device_id in self.devices:
-            device = self.devices[device_id]
-            if isinstance(device, Curtain):
-                results.append(self.close_curtain(device_id))
+        with self.batch_saves():
+            for device_id in self.devices:
+                device = self.devices[device_id]
+                if isinstance(device, Curtain):
+                    results.append(self.close_curtain(device_id))
         return results
 
     def open_all_curtains(self) -> list[str]:
         """打开所有窗帘."""
         results = []
-        for device_id in self.devices:
-            device = self.devices[device_id]
-            if isinstance(device, Curtain):
-                results.append(self.open_curtain(device_id))
+        with self.batch_saves():
+            for device_id in self.devices:
+                device = self.devices[device_id]
+                if isinstance(device, Curtain):
+                    results.append(self.open_curtain(device_id))
         return results
 
     def turn_off_all_fans(self) -> list[str]:
         """关闭所有风扇."""
         results = []
-        for device_id in self.devices:
-            device = self.devices[device_id]
-            if isinstance(device, Fan):
-                results.append(self.turn_off_fan(device_id))
+        with self.batch_saves():
+            for device_id in self.devices:
+                device = self.devices[device_id]
+                if isinstance(device, Fan):
+                    results.append(self.turn_off_fan(device_id))
         return results
@@ -1,5 +1,6 @@
 """Voice Input Module - Handles audio recording and transcription."""
 
+import asyncio
 import os
 import tempfile
 import wave
@@ -29,6 +30,7 @@ class VoiceListener:
         self.timeout = timeout
         self.phrase_threshold = phrase_threshold
         self.sr = None
+        self._client: httpx.AsyncClient | None = None
         self._init_speech_recognition()
 
     def _init_speech_recognition(self) -> None:
@@ -138,6 +140,28 @@ class VoiceListener:
         except OSError as e:
             raise RuntimeError(f"Microphone error: {e}")
 
+    def _get_client(self) -> httpx.AsyncClient:
+        """Get the shared HTTP client, creating it on first use.
+
+        Reusing one client keeps the connection to the transcription API
+        alive between recordings.
+
+        Returns:
+            The httpx.AsyncClient used for transcription requests
+        """
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                timeout=30.0,
+                limits=httpx.Limits(max_keepalive_connections=4, keepalive_expiry=60.0),
+            )
+        return self._client
+
+    async def aclose(self) -> None:
+        """Close the shared HTTP client."""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
     async def transcribe(self, audio_file_path: str) -> str:
         """Transcribe audio to text using OpenAI Whisper API.
 
@@ -172,16 +196,15 @@ class VoiceListener:
                     "language": "zh",  # Default to Chinese, auto-detects if not specified
                 }
 
-                async with httpx.AsyncClient(timeout=30.0) as client:
-                    response = await client.post(
-                        self.WHISPER_API_URL,
-                        headers=headers,
-                        files=files,
-                        data=data
-                    )
-                    response.raise_for_status()
-                    result = response.json()
-                    return result.get("text", "").strip()
+                response = await self._get_client().post(
+                    self.WHISPER_API_URL,
+                    headers=headers,
+                    files=files,
+                    data=data
+                )
+                response.raise_for_status()
+                result = response.json()
+                return result.get("text", "").strip()
 
         except httpx.HTTPStatusError as e:
             error_detail = e.response.text if e.response else "No response"
@@ -220,8 +243,6 @@ class VoiceListener:
         Returns:
             Transcribed text
         """
-        import asyncio
-
         try:
             loop = asyncio.get_event_loop()
         except RuntimeError:
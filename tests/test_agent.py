@@ -0,0 +1,848 @@
+"""Tests for SmartHomeAgent request handling internals."""
+
+import asyncio
+import json
+import logging
+import threading
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import httpx
+import pytest
+
+from smarthome_mock_ai import agent as agent_module
+from smarthome_mock_ai.agent import SmartHomeAgent
+from smarthome_mock_ai.devices import Light, Thermostat
+from smarthome_mock_ai.interaction_logger import InteractionLogger
+from smarthome_mock_ai.simulator import HomeSimulator
+
+
+@pytest.fixture
+def simulator():
+    """Create a simulator with a light and a thermostat."""
+    sim = HomeSimulator(persist_state=False)
+    sim.register_device(Thermostat(device_id="thermostat", name="Thermostat", room="living_room"))
+    sim.register_device(
+        Light(device_id="living_room_light", name="Living Room Light", room="living_room")
+    )
+    return sim
+
+
+@pytest.fixture
+def agent(simulator):
+    """Create an agent without logging or learning."""
+    return SmartHomeAgent(simulator, enable_logging=False, enable_learning=False)
+
+
+async def _lines(*lines):
+    """Yield SSE lines like httpx.Response.aiter_lines()."""
+    for line in lines:
+        yield line
+
+
+class TestStreaming:
+    """Test streamed LLM responses."""
+
+    @pytest.mark.asyncio
+    async def test_assemble_stream_emits_sentences(self, agent):
+        """Text deltas are emitted sentence by sentence and joined into the message."""
+        sentences = []
+        response = await agent._assemble_stream(
+            _lines(
+                'data: {"choices": [{"delta": {"content": "你好"}}]}',
+                'data: {"choices": [{"delta": {"content": "!今天"}}]}',
+                "",
+                'data: {"choices": [{"delta": {"content": "很好。再见"}}]}',
+                "data: [DONE]",
+            ),
+            sentences.append,
+        )
+
+        assert sentences == ["你好!", "今天很好。", "再见"]
+        message = response["choices"][0]["message"]
+        assert message["content"] == "你好!今天很好。再见"
+        assert "tool_calls" not in message
+
+    @pytest.mark.asyncio
+    async def test_assemble_stream_merges_tool_call_fragments(self, agent):
+        """Tool call argument fragments are concatenated per index."""
+        response = await agent._assemble_stream(
+            _lines(
+                'data: {"choices": [{"delta": {"tool_calls": [{"index": 0, "id": "call_1", '
+                '"function": {"name": "turn_on_light", "arguments": "{\\"device_id\\": "}}]}}]}',
+                'data: {"choices": [{"delta": {"tool_calls": [{"index": 0, '
+                '"function": {"arguments": "\\"living_room_light\\"}"}}]}}]}',
+                "data: [DONE]",
+            ),
+            lambda sentence: None,
+        )
+
+        tool_calls = response["choices"][0]["message"]["tool_calls"]
+        assert len(tool_calls) == 1
+        assert tool_calls[0]["function"]["name"] == "turn_on_light"
+        assert tool_calls[0]["function"]["arguments"] == '{"device_id": "living_room_light"}'
+
+    @pytest.mark.asyncio
+    async def test_assemble_stream_reports_complete_tool_calls_early(self, agent):
+        """A tool call is reported as soon as its arguments parse, before the stream ends."""
+        events = []
+
+        async def lines():
+            yield (
+                'data: {"choices": [{"delta": {"tool_calls": [{"index": 0, '
+                '"function": {"name": "turn_off_all_lights", "arguments": "{}"}}]}}]}'
+            )
+            events.append("second chunk")
+            yield 'data: {"choices": [{"delta": {"content": "晚安。"}}]}'
+            yield "data: [DONE]"
+
+        await agent._assemble_stream(
+            lines(),
+            lambda sentence: None,
+            lambda index, name, arguments: events.append((index, name, arguments)),
+        )
+
+        assert events == [(0, "turn_off_all_lights", {}), "second chunk"]
+
+    @pytest.mark.asyncio
+    async def test_assemble_stream_reports_calls_without_arguments(self, agent):
+        """A tool call whose arguments never arrive is reported with empty arguments."""
+        events = []
+
+        await agent._assemble_stream(
+            _lines(
+                'data: {"choices": [{"delta": {"tool_calls": [{"index": 0, '
+                '"function": {"name": "turn_off_all_lights"}}]}}]}',
+                "data: [DONE]",
+            ),
+            lambda sentence: None,
+            lambda index, name, arguments: events.append((index, name, arguments)),
+        )
+
+        assert events == [(0, "turn_off_all_lights", {})]
+
+    @pytest.mark.asyncio
+    async def test_process_uses_early_started_tool_calls(self, agent, simulator):
+        """Tool calls started during streaming are not executed a second time."""
+        tool_call = {
+            "function": {"name": "turn_on_light", "arguments": '{"device_id": "living_room_light"}'}
+        }
+        mock_response = {"choices": [{"message": {"role": "assistant", "tool_calls": [tool_call]}}]}
+
+        async def fake_stream(messages, on_sentence, on_tool_call):
+            on_tool_call(0, "turn_on_light", {"device_id": "living_room_light"})
+            return mock_response
+
+        with (
+            patch.object(agent, "_call_llm_stream", new=fake_stream),
+            patch.object(agent, "_execute_tool_call", wraps=agent._execute_tool_call) as execute,
+        ):
+            result = await agent.process("打开客厅灯", on_sentence=lambda sentence: None)
+
+        execute.assert_called_once()
+        assert result["actions_taken"] == [
+            {"tool": "turn_on_light", "arguments": {"device_id": "living_room_light"}}
+        ]
+        assert simulator.get_device("living_room_light").get_status().state["is_on"] is True
+
+    @pytest.mark.asyncio
+    async def test_stream_arguments_with_trailing_whitespace_are_executed(self, agent, simulator):
+        """Arguments ending in whitespace are still dispatched and every reported call runs."""
+
+        async def fake_stream(messages, on_sentence, on_tool_call):
+            return await agent._assemble_stream(
+                _lines(
+                    'data: {"choices": [{"delta": {"tool_calls": [{"index": 0, "function": '
+                    '{"name": "turn_on_light", '
+                    '"arguments": "{\\"device_id\\": \\"living_room_light\\"}\\n"}}]}}]}',
+                    'data: {"choices": [{"delta": {"tool_calls": [{"index": 1, "function": '
+                    '{"name": "set_temperature", '
+                    '"arguments": "{\\"device_id\\": \\"thermostat\\", \\"temp\\": 26}"}}]}}]}',
+                    "data: [DONE]",
+                ),
+                on_sentence,
+                on_tool_call,
+            )
+
+        with patch.object(agent, "_call_llm_stream", new=fake_stream):
+            result = await agent.process("回家啦", on_sentence=lambda sentence: None)
+
+        assert result["success"] is True
+        assert [action["tool"] for action in result["actions_taken"]] == [
+            "turn_on_light",
+            "set_temperature",
+        ]
+        assert simulator.get_device("living_room_light").get_status().state["is_on"] is True
+        assert simulator.get_device("thermostat").get_status().state["target_temp"] == 26
+
+    @pytest.mark.asyncio
+    async def test_calls_not_started_during_stream_are_executed(self, agent, simulator):
+        """A call in the final message that was never started early is executed afterwards."""
+        calls = [
+            {
+                "function": {
+                    "name": "set_temperature",
+                    "arguments": '{"device_id": "thermostat", "temp": 26}',
+                }
+            },
+            {
+                "function": {
+                    "name": "turn_on_light",
+                    "arguments": '{"device_id": "living_room_light"}',
+                }
+            },
+        ]
+        mock_response = {"choices": [{"message": {"role": "assistant", "tool_calls": calls}}]}
+
+        async def fake_stream(messages, on_sentence, on_tool_call):
+            on_tool_call(0, "set_temperature", {"device_id": "thermostat", "temp": 26})
+            return mock_response
+
+        with patch.object(agent, "_call_llm_stream", new=fake_stream):
+            result = await agent.process("回家啦", on_sentence=lambda sentence: None)
+
+        assert len(result["message"].splitlines()) == 2
+        assert simulator.get_device("thermostat").get_status().state["target_temp"] == 26
+        assert simulator.get_device("living_room_light").get_status().state["is_on"] is True
+
+    @pytest.mark.asyncio
+    async def test_stream_error_reports_early_started_tool_calls(self, agent, simulator):
+        """Tool calls already executed before a mid-stream error are returned and logged."""
+        agent.enable_logging = True
+        agent.logger = MagicMock()
+        action = {"tool": "turn_on_light", "arguments": {"device_id": "living_room_light"}}
+
+        async def failing_stream(messages, on_sentence, on_tool_call):
+            on_tool_call(0, action["tool"], action["arguments"])
+            return {"error": "网络连接失败"}
+
+        with patch.object(agent, "_call_llm_stream", new=failing_stream):
+            result = await agent.process("打开客厅灯", on_sentence=lambda sentence: None)
+
+        assert result["success"] is False
+        assert result["actions_taken"] == [action]
+        assert "网络连接失败" in result["message"]
+        assert simulator.get_device("living_room_light").get_status().state["is_on"] is True
+        logged = agent.logger.log_interaction.call_args.kwargs["agent_action"]
+        assert logged["error"] == "网络连接失败"
+        assert logged["actions"] == [action]
+
+    @pytest.mark.asyncio
+    async def test_process_uses_stream_when_callback_given(self, agent):
+        """process() switches to the streaming call when on_sentence is provided."""
+        mock_response = {"choices": [{"message": {"role": "assistant", "content": "你好!"}}]}
+
+        with patch.object(
+            agent, "_call_llm_stream", new=AsyncMock(return_value=mock_response)
+        ) as mock_stream:
+            result = await agent.process("你好", on_sentence=lambda sentence: None)
+
+        mock_stream.assert_awaited_once()
+        assert result["success"] is True
+        assert result["message"] == "你好!"
+
+
+class TestUnexpectedErrors:
+    """Test error responses for unexpected request failures."""
+
+    @pytest.mark.parametrize(("debug", "has_trace"), [("0", False), ("1", True)])
+    def test_traceback_only_in_debug_mode(self, simulator, monkeypatch, debug, has_trace):
+        """The traceback is attached only when SMARTHOME_DEBUG is enabled."""
+        monkeypatch.setenv("SMARTHOME_DEBUG", debug)
+        agent = SmartHomeAgent(simulator, enable_logging=False, enable_learning=False)
+
+        try:
+            raise ValueError("boom")
+        except ValueError as e:
+            error = agent._unexpected_error(e)["error"]
+
+        assert "boom" in error
+        assert ("Traceback" in error) is has_trace
+
+    def test_traceback_is_logged_at_debug_level(self, simulator, monkeypatch, caplog):
+        """Outside debug mode the traceback is still available through logging."""
+        monkeypatch.setenv("SMARTHOME_DEBUG", "0")
+        agent = SmartHomeAgent(simulator, enable_logging=False, enable_learning=False)
+
+        with caplog.at_level("DEBUG", logger="smarthome_mock_ai.agent"):
+            try:
+                raise ValueError("boom")
+            except ValueError as e:
+                agent._unexpected_error(e)
+
+        assert caplog.records[-1].exc_info[0] is ValueError
+
+
+class TestProcessSync:
+    """Test the synchronous processing entry point."""
+
+    def test_process_sync_reuses_background_loop(self, agent):
+        """Repeated sync calls run on one persistent event loop."""
+        loops = []
+        mock_response = {"choices": [{"message": {"role": "assistant", "content": "好的"}}]}
+
+        async def fake_call_llm(messages):
+            loops.append(asyncio.get_running_loop())
+            return mock_response
+
+        with patch.object(agent, "_call_llm", new=fake_call_llm):
+            first = agent.process_sync("你好")
+            second = agent.process_sync("谢谢")
+
+        assert first["message"] == second["message"] == "好的"
+        assert loops[0] is loops[1]
+
+    def test_close_sync_closes_background_client(self, agent):
+        """close_sync() closes the client used by process_sync."""
+        clients = []
+        mock_response = {"choices": [{"message": {"role": "assistant", "content": "好的"}}]}
+
+        async def fake_call_llm(messages):
+            clients.append(agent._get_client())
+            return mock_response
+
+        with patch.object(agent, "_call_llm", new=fake_call_llm):
+            agent.process_sync("你好")
+            agent.process_sync("谢谢")
+
+        assert clients[0] is clients[1]
+        agent.close_sync()
+        assert clients[0].is_closed
+        assert not agent._clients
+
+    def test_each_event_loop_gets_its_own_client(self, agent):
+        """A client bound to a finished loop is closed when the loop exits, not reused."""
+
+        async def get_client():
+            return agent._get_client()
+
+        first = asyncio.run(get_client())
+        assert first.is_closed
+        assert not agent._clients
+
+        second = asyncio.run(get_client())
+        assert second is not first
+        assert second.is_closed
+        assert not agent._clients and not agent._client_guards
+
+    def test_stopping_sync_loop_closes_its_client(self, agent):
+        """Stopping the process_sync loop closes the client opened on it."""
+        mock_response = {"choices": [{"message": {"role": "assistant", "content": "好的"}}]}
+        clients = []
+
+        async def fake_call_llm(messages):
+            clients.append(agent._get_client())
+            return mock_response
+
+        with patch.object(agent, "_call_llm", new=fake_call_llm):
+            agent.process_sync("你好")
+
+        agent_module._stop_sync_loop()
+
+        assert clients[0].is_closed
+        assert not agent._clients
+
+
+class TestHttpClient:
+    """Test the shared HTTP client lifecycle."""
+
+    @pytest.mark.asyncio
+    async def test_client_is_reused_until_closed(self, agent):
+        """The same client serves every request until aclose() is called."""
+        client = agent._get_client()
+        assert agent._get_client() is client
+
+        await agent.aclose()
+        assert client.is_closed
+        assert not agent._clients
+        assert agent._get_client() is not client
+        await agent.aclose()
+
+    @pytest.mark.asyncio
+    async def test_call_llm_sends_raw_body_and_decodes_response(self, agent, monkeypatch):
+        """The request body is the pre-encoded payload and the reply is decoded with orjson."""
+        monkeypatch.setenv("ZHIPU_API_KEY", "test-key")
+        agent.refresh_api_key()
+        messages = [{"role": "user", "content": "你好"}]
+        requests = []
+
+        def handler(request):
+            requests.append(request)
+            return httpx.Response(200, json={"choices": [{"message": {"content": "你好!"}}]})
+
+        agent._clients[asyncio.get_running_loop()] = httpx.AsyncClient(
+            transport=httpx.MockTransport(handler)
+        )
+        response = await agent._call_llm(messages)
+
+        assert response == {"choices": [{"message": {"content": "你好!"}}]}
+        assert requests[0].content == agent._build_body(messages)
+        assert requests[0].headers["Authorization"] == "Bearer test-key"
+        await agent.aclose()
+
+    def test_api_key_read_once_until_refreshed(self, agent, monkeypatch):
+        """The key and its header dict are cached until refresh_api_key() is called."""
+        monkeypatch.setenv("ZHIPU_API_KEY", "key-1")
+        agent.refresh_api_key()
+        headers = agent._auth_headers()
+        assert headers == {"Authorization": "Bearer key-1"}
+        assert agent._auth_headers() is headers
+
+        monkeypatch.setenv("ZHIPU_API_KEY", "key-2")
+        assert agent.API_KEY == "key-1"
+        agent.refresh_api_key()
+        assert agent._auth_headers() == {"Authorization": "Bearer key-2"}
+
+        monkeypatch.delenv("ZHIPU_API_KEY")
+        agent.refresh_api_key()
+        assert agent._auth_headers() is None
+
+    @pytest.mark.asyncio
+    async def test_async_context_manager_closes_client(self, simulator):
+        """Leaving `async with` closes the shared client."""
+        async with SmartHomeAgent(simulator, enable_logging=False, enable_learning=False) as agent:
+            client = agent._get_client()
+
+        assert client.is_closed
+        assert not agent._clients
+
+    def test_http2_can_be_disabled(self, simulator, monkeypatch):
+        """HTTP/2 is used only when h2 is installed and the flag is left on."""
+        monkeypatch.setattr("smarthome_mock_ai.agent.h2", object())
+        assert SmartHomeAgent(simulator, enable_logging=False, enable_learning=False).enable_http2
+        agent = SmartHomeAgent(
+            simulator, enable_logging=False, enable_learning=False, enable_http2=False
+        )
+        assert agent.enable_http2 is False
+
+        monkeypatch.setattr("smarthome_mock_ai.agent.h2", None)
+        assert not SmartHomeAgent(
+            simulator, enable_logging=False, enable_learning=False
+        ).enable_http2
+
+    @pytest.mark.asyncio
+    async def test_warmup_without_api_key_is_noop(self, agent, monkeypatch):
+        """Warmup does not open a connection when no API key is configured."""
+        monkeypatch.delenv("ZHIPU_API_KEY", raising=False)
+        agent.refresh_api_key()
+        await agent.warmup()
+        assert not agent._clients
+
+    @pytest.mark.asyncio
+    async def test_warmup_swallows_unexpected_errors(self, agent, monkeypatch, caplog):
+        """Errors other than httpx.HTTPError are logged at debug level, not raised."""
+        monkeypatch.setenv("ZHIPU_API_KEY", "test-key")
+        agent.refresh_api_key()
+        client = MagicMock()
+        client.head = AsyncMock(side_effect=ValueError("bad proxy URL"))
+
+        with (
+            patch.object(agent, "_get_client", return_value=client),
+            caplog.at_level(logging.DEBUG, logger="smarthome_mock_ai.agent"),
+        ):
+            await agent.warmup()
+
+        assert any(record.exc_info for record in caplog.records)
+
+
+class TestPromptCache:
+    """Test caching of the system prompt and tool definitions."""
+
+    def test_system_prompt_is_cached(self, agent):
+        """The prompt is rendered once while the device set is unchanged."""
+        assert agent._build_system_prompt() is agent._build_system_prompt()
+
+    def test_cache_invalidated_on_device_change(self, agent, simulator):
+        """Registering a device refreshes the prompt and the tool enums."""
+        prompt = agent._build_system_prompt()
+        simulator.register_device(
+            Light(device_id="kitchen_light", name="Kitchen Light", room="kitchen")
+        )
+
+        new_prompt = agent._build_system_prompt()
+        assert new_prompt != prompt
+        assert "kitchen_light" in new_prompt
+
+        get_state = next(t for t in agent.tools if t["function"]["name"] == "get_device_state")
+        assert (
+            "kitchen_light"
+            in get_state["function"]["parameters"]["properties"]["device_id"]["enum"]
+        )
+
+    def test_tools_shared_between_agents(self, agent, simulator):
+        """Agents over the same device set share one tools structure."""
+        other = SmartHomeAgent(simulator, enable_logging=False, enable_learning=False)
+        assert other.tools is agent.tools
+
+    def test_system_message_is_shared_until_device_change(self, agent, simulator):
+        """The system message dict is reused and rebuilt with the prompt."""
+        message = agent._build_system_message()
+        assert agent._build_system_message() is message
+
+        simulator.register_device(
+            Light(device_id="kitchen_light", name="Kitchen Light", room="kitchen")
+        )
+        new_message = agent._build_system_message()
+        assert new_message is not message
+        assert "kitchen_light" in new_message["content"]
+
+
+class TestToolExecution:
+    """Test execution of tool calls returned by the LLM."""
+
+    @pytest.mark.asyncio
+    async def test_multiple_tool_calls_run_in_order(self, agent, simulator):
+        """Tool calls on the same device are applied in the order given."""
+        mock_response = {
+            "choices": [
+                {
+                    "message": {
+                        "role": "assistant",
+                        "tool_calls": [
+                            {
+                                "function": {
+                                    "name": "turn_on_light",
+                                    "arguments": '{"device_id": "living_room_light"}',
+                                }
+                            },
+                            {
+                                "function": {
+                                    "name": "set_light_brightness",
+                                    "arguments": '{"device_id": "living_room_light", "level": 30}',
+                                }
+                            },
+                        ],
+                    }
+                }
+            ]
+        }
+
+        with patch.object(agent, "_call_llm", new=AsyncMock(return_value=mock_response)):
+            result = await agent.process("把客厅灯打开并调暗")
+
+        assert [action["tool"] for action in result["actions_taken"]] == [
+            "turn_on_light",
+            "set_light_brightness",
+        ]
+        assert len(result["message"].split("\n")) == 2
+        state = simulator.get_device("living_room_light").get_status().state
+        assert state["is_on"] is True
+        assert state["brightness"] == 30
+
+    @pytest.mark.asyncio
+    async def test_empty_arguments_are_accepted(self, agent, simulator):
+        """No-argument tools may send "" as their arguments."""
+        simulator.turn_on_light("living_room_light")
+        tool_call = {"function": {"name": "turn_off_all_lights", "arguments": ""}}
+        mock_response = {"choices": [{"message": {"role": "assistant", "tool_calls": [tool_call]}}]}
+
+        with patch.object(agent, "_call_llm", new=AsyncMock(return_value=mock_response)):
+            result = await agent.process("关灯")
+
+        assert result["success"] is True
+        assert result["actions_taken"] == [{"tool": "turn_off_all_lights", "arguments": {}}]
+        assert simulator.get_device("living_room_light").get_status().state["is_on"] is False
+
+
+class TestRequestBody:
+    """Test encoding of the LLM request body."""
+
+    def test_body_matches_full_payload(self, agent):
+        """The spliced body decodes to the same payload as a plain dict."""
+        messages = [{"role": "user", "content": "打开客厅灯"}]
+
+        body = json.loads(agent._build_body(messages, stream=True))
+
+        assert body == {
+            "model": "glm-4-flash",
+            "messages": messages,
+            "tools": agent.tools,
+            "tool_choice": "auto",
+            "temperature": 0.7,
+            "max_tokens": 2048,
+            "stream": True,
+        }
+        assert "stream" not in json.loads(agent._build_body(messages))
+
+
+class TestResponseCache:
+    """Test reuse of tool calls for repeated commands."""
+
+    @pytest.mark.asyncio
+    async def test_repeated_command_skips_llm(self, agent, simulator):
+        """A repeated command replays the cached tool calls without calling the LLM."""
+        mock_response = {
+            "choices": [
+                {
+                    "message": {
+                        "role": "assistant",
+                        "tool_calls": [
+                            {
+                                "function": {
+                                    "name": "turn_on_light",
+                                    "arguments": '{"device_id": "living_room_light"}',
+                                }
+                            }
+                        ],
+                    }
+                }
+            ]
+        }
+
+        with patch.object(
+            agent, "_call_llm", new=AsyncMock(return_value=mock_response)
+        ) as mock_llm:
+            await agent.process("打开客厅灯")
+            simulator.turn_off_light("living_room_light")
+            result = await agent.process(" 打开客厅灯 ")
+
+        mock_llm.assert_awaited_once()
+        assert result["actions_taken"] == [
+            {"tool": "turn_on_light", "arguments": {"device_id": "living_room_light"}}
+        ]
+        assert simulator.get_device("living_room_light").get_status().state["is_on"] is True
+
+    @pytest.mark.asyncio
+    async def test_rejected_tool_calls_are_not_replayed(self, agent):
+        """Discarding a rejected action sends the next identical command to the LLM."""
+        tool_call = {
+            "function": {
+                "name": "turn_off_light",
+                "arguments": '{"device_id": "living_room_light"}',
+            }
+        }
+        mock_response = {"choices": [{"message": {"role": "assistant", "tool_calls": [tool_call]}}]}
+        mock_llm = AsyncMock(return_value=mock_response)
+
+        with patch.object(agent, "_call_llm", new=mock_llm):
+            await agent.process("打开客厅灯")
+            replayed = await agent.process("打开客厅灯")
+            assert mock_llm.await_count == 1
+
+            assert agent.discard_cached_response(replayed["action_id"]) is True
+            assert agent.discard_cached_response(replayed["action_id"]) is False
+            await agent.process("打开客厅灯")
+
+        assert mock_llm.await_count == 2
+
+    @pytest.mark.asyncio
+    async def test_text_replies_are_not_cached(self, agent):
+        """Chit-chat replies always go to the LLM."""
+        mock_response = {"choices": [{"message": {"role": "assistant", "content": "你好!"}}]}
+
+        with patch.object(
+            agent, "_call_llm", new=AsyncMock(return_value=mock_response)
+        ) as mock_llm:
+            await agent.process("你好")
+            await agent.process("你好")
+
+        assert mock_llm.await_count == 2
+
+
+class TestFastPath:
+    """Test rule-based handling of simple commands."""
+
+    @pytest.mark.asyncio
+    async def test_simple_command_skips_llm(self, agent, simulator):
+        """An unambiguous "打开<设备名>" command is executed without the LLM."""
+        with patch.object(agent, "_call_llm", new=AsyncMock()) as mock_llm:
+            result = await agent.process("打开Living Room Light")
+
+        mock_llm.assert_not_awaited()
+        assert result["actions_taken"] == [
+            {"tool": "turn_on_light", "arguments": {"device_id": "living_room_light"}}
+        ]
+        assert simulator.get_device("living_room_light").get_status().state["is_on"] is True
+
+    @pytest.mark.asyncio
+    async def test_bulk_command_skips_llm(self, agent):
+        """Fixed bulk phrases map straight to the bulk tools."""
+        with patch.object(agent, "_call_llm", new=AsyncMock()) as mock_llm:
+            result = await agent.process("关闭所有灯。")
+
+        mock_llm.assert_not_awaited()
+        assert result["actions_taken"] == [{"tool": "turn_off_all_lights", "arguments": {}}]
+
+    @pytest.mark.parametrize("command", ["打开客厅灯并调到50%", "打开thermostat", "太热了"])
+    def test_ambiguous_commands_fall_through(self, agent, command):
+        """Anything that is not an exact device match is left to the LLM."""
+        assert agent._match_fast_path(command.lower()) is None
+
+    def test_device_index_follows_topology(self, agent, simulator):
+        """Devices registered after construction become resolvable."""
+        simulator.register_device(Light(device_id="kitchen_light", name="厨房灯", room="kitchen"))
+        agent._sync_topology()
+
+        assert agent._resolve_device("厨房灯") == ("kitchen_light", "light")
+        assert agent._resolve_device("KITCHEN_LIGHT") == ("kitchen_light", "light")
+
+    def test_tool_call_accepts_device_name(self, agent, simulator):
+        """A device name supplied in place of the id is mapped to the id."""
+        result = agent._execute_tool_call("turn_on_light", {"device_id": "Living Room Light"}, {})
+
+        assert "执行失败" not in result
+        assert simulator.get_device("living_room_light").get_status().state["is_on"] is True
+
+
+class TestInteractionLogging:
+    """Test writing of interaction logs."""
+
+    @pytest.mark.asyncio
+    async def test_interaction_is_written_after_flush(self, agent):
+        """The log record written in the background is present once flush_logs() returns."""
+        agent.enable_logging = True
+        agent.logger = MagicMock()
+        mock_response = {"choices": [{"message": {"role": "assistant", "content": "你好!"}}]}
+
+        with patch.object(agent, "_call_llm", new=AsyncMock(return_value=mock_response)):
+            result = await agent.process("你好")
+        await agent.flush_logs(result["action_id"])
+
+        agent.logger.log_interaction.assert_called_once()
+        assert agent.logger.log_interaction.call_args.kwargs["action_id"] == result["action_id"]
+        await agent.aclose()
+
+    @pytest.mark.asyncio
+    async def test_process_does_not_wait_for_log_write(self, agent):
+        """process() returns while the SQLite write is still pending."""
+        agent.enable_logging = True
+        agent.logger = MagicMock()
+        write_started = threading.Event()
+        release_write = threading.Event()
+
+        def slow_write(**record):
+            write_started.set()
+            release_write.wait(timeout=5)
+
+        agent.logger.log_interaction.side_effect = slow_write
+        mock_response = {"choices": [{"message": {"role": "assistant", "content": "你好!"}}]}
+
+        with patch.object(agent, "_call_llm", new=AsyncMock(return_value=mock_response)):
+            result = await agent.process("你好")
+
+        assert result["success"] is True
+        assert write_started.wait(timeout=5)
+        assert result["action_id"] in agent._pending_logs
+        release_write.set()
+        await agent.flush_logs(result["action_id"])
+        assert result["action_id"] not in agent._pending_logs
+
+    def test_interactions_survive_separate_event_loops(self, agent, tmp_path):
+        """Records are not lost when each process() call runs in its own asyncio.run()."""
+        agent.enable_logging = True
+        agent.logger = InteractionLogger(str(tmp_path / "history.db"))
+
+        tool_call = {
+            "function": {"name": "turn_on_light", "arguments": '{"device_id": "living_room_light"}'}
+        }
+        mock_response = {"choices": [{"message": {"role": "assistant", "tool_calls": [tool_call]}}]}
+
+        with patch.object(agent, "_call_llm", new=AsyncMock(return_value=mock_response)):
+            asyncio.run(agent.process("打开客厅灯"))
+            asyncio.run(agent.process("打开客厅的灯"))
+        asyncio.run(agent.flush_logs())
+
+        assert len(agent.logger.get_recent_interactions(limit=10)) == 2
+
+
+class TestArgumentValidation:
+    """Test rejection of tool arguments that violate the tool schema."""
+
+    def test_out_of_range_value_is_rejected(self, agent, simulator):
+        """Values outside minimum/maximum never reach the simulator."""
+        before = simulator.get_device("thermostat").get_status().state
+
+        result = agent._execute_tool_call(
+            "set_temperature", {"device_id": "thermostat", "temp": 99}, {}
+        )
+
+        assert result.startswith("参数错误")
+        assert simulator.get_device("thermostat").get_status().state == before
+
+    def test_unknown_device_and_missing_argument_are_rejected(self, agent):
+        """Device ids outside the enum and missing required arguments are rejected."""
+        assert agent._execute_tool_call(
+            "turn_on_light", {"device_id": "garage_light"}, {}
+        ).startswith("参数错误")
+        assert agent._execute_tool_call(
+            "set_light_brightness", {"device_id": "living_room_light"}, {}
+        ).startswith("参数错误")
+        assert agent._execute_tool_call(
+            "set_temperature", {"device_id": "thermostat", "temp": "hot"}, {}
+        ).startswith("参数错误")
+
+    def test_validators_follow_topology(self, agent, simulator):
+        """Devices registered later are accepted once the topology is synced."""
+        simulator.register_device(
+            Light(device_id="kitchen_light", name="Kitchen Light", room="kitchen")
+        )
+        agent._sync_topology()
+
+        result = agent._execute_tool_call("turn_on_light", {"device_id": "kitchen_light"}, {})
+
+        assert not result.startswith("参数错误")
+
+
+class TestMalformedResponses:
+    """Test handling of LLM responses with an unexpected shape."""
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize(
+        "response",
+        [
+            {"choices": []},
+            {"choices": [None]},
+            {"choices": [{"message": "oops"}]},
+            {
+                "choices": [
+                    {
+                        "message": {
+                            "tool_calls": [{"function": {"name": "turn_on_light", "arguments": 1}}]
+                        }
+                    }
+                ]
+            },
+            {
+                "choices": [
+                    {
+                        "message": {
+                            "tool_calls": [
+                                {"function": {"name": "turn_on_light", "arguments": "{"}}
+                            ]
+                        }
+                    }
+                ]
+            },
+        ],
+    )
+    async def test_malformed_response_reports_parse_error(self, agent, response):
+        """Malformed responses become a parse-failure result instead of raising."""
+        with patch.object(agent, "_call_llm", new=AsyncMock(return_value=response)):
+            result = await agent.process("打开客厅灯")
+
+        assert result["success"] is False
+        assert "解析响应失败" in result["message"]
+        await agent.aclose()
+
+
+class TestRequestCoalescing:
+    """Test sharing of identical in-flight LLM requests."""
+
+    @pytest.mark.asyncio
+    async def test_concurrent_identical_requests_share_one_call(self, agent):
+        """Identical requests issued together trigger a single LLM call."""
+        mock_response = {"choices": [{"message": {"role": "assistant", "content": "你好!"}}]}
+
+        async def slow_call(messages):
+            await asyncio.sleep(0.01)
+            return mock_response
+
+        with patch.object(agent, "_call_llm", new=AsyncMock(side_effect=slow_call)) as mock_call:
+            results = await asyncio.gather(
+                agent.process("你好"), agent.process(" 你好 "), agent.process("再见")
+            )
+
+        assert mock_call.await_count == 2
+        assert [r["message"] for r in results[:2]] == ["你好!", "你好!"]
+        assert results[0]["action_id"] != results[1]["action_id"]
+        assert agent._inflight == {}
+        await agent.aclose()
@@ -189,6 +189,13 @@ class TestPreferenceModelPrediction:
         )
         assert prediction is None
 
+    def test_is_empty(self, preference_model):
+        """Test that is_empty reflects whether anything has been learned."""
+        assert preference_model.is_empty
+
+        preference_model.confidence["set_temperature"]["evening_weekday"][24] += 1
+        assert not preference_model.is_empty
+
     def test_predict_with_learned_preferences(self, temp_db_path, preference_model):
         """Test prediction after learning preferences."""
         # Setup: Train the model with corrections
@@ -0,0 +1,73 @@
+"""Tests for the CLI feedback pipeline in main.py."""
+
+import asyncio
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+import main
+
+
+def _make_agent() -> MagicMock:
+    agent = MagicMock()
+    agent.flush_logs = AsyncMock()
+    return agent
+
+
+async def _write_feedback(agent: MagicMock, entries: list[tuple[str, int, str | None]]) -> None:
+    feedback_queue: main.FeedbackQueue = asyncio.Queue()
+    writer = asyncio.create_task(main.feedback_writer(agent, feedback_queue))
+    for entry in entries:
+        feedback_queue.put_nowait(entry)
+    await asyncio.wait_for(feedback_queue.join(), timeout=5)
+    writer.cancel()
+
+
+class TestFeedbackWriter:
+    """Test batching of user feedback."""
+
+    @pytest.mark.asyncio
+    async def test_queued_feedback_is_written_in_one_batch(self):
+        """Feedback queued together reaches record_feedback_batch in a single call."""
+        agent = _make_agent()
+        entries = [("a1", 1, None), ("a2", -1, "关灯"), ("a3", 1, None)]
+
+        await _write_feedback(agent, entries)
+
+        agent.logger.record_feedback_batch.assert_called_once_with(entries)
+        agent.flush_logs.assert_awaited_once_with("a1", "a2", "a3")
+
+    def test_writer_works_across_event_loops(self):
+        """Each run creates its own queue, so a second event loop is not rejected."""
+        agent = _make_agent()
+
+        asyncio.run(_write_feedback(agent, [("a1", 1, None)]))
+        asyncio.run(_write_feedback(agent, [("a2", -1, None)]))
+
+        assert agent.logger.record_feedback_batch.call_count == 2
+
+
+class TestCollectFeedback:
+    """Test collecting feedback from the user."""
+
+    @pytest.mark.asyncio
+    async def test_positive_feedback_is_queued(self):
+        """A 'y' answer puts a positive score on the given queue."""
+        feedback_queue: main.FeedbackQueue = asyncio.Queue()
+
+        with patch.object(main, "ainput", new=AsyncMock(return_value="y")):
+            await main.collect_feedback("a1", MagicMock(), None, feedback_queue)
+
+        assert feedback_queue.get_nowait() == ("a1", 1, None)
+
+    @pytest.mark.asyncio
+    async def test_negative_feedback_discards_cached_response(self):
+        """An 'n' answer queues the correction and drops the cached tool calls."""
+        feedback_queue: main.FeedbackQueue = asyncio.Queue()
+        agent = _make_agent()
+
+        with patch.object(main, "ainput", new=AsyncMock(side_effect=["n", "关灯"])):
+            await main.collect_feedback("a1", agent.logger, agent, feedback_queue)
+
+        assert feedback_queue.get_nowait() == ("a1", -1, "关灯")
+        agent.discard_cached_response.assert_called_once_with("a1")
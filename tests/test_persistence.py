@@ -2,6 +2,7 @@
 
 import json
 import os
+from unittest.mock import patch
 
 import pytest
 
@@ -9,6 +10,7 @@ from smarthome_mock_ai.device_persistence import DeviceStateManager
 from smarthome_mock_ai.devices import Light, Thermostat
 from smarthome_mock_ai.interaction_logger import InteractionLogger
 from smarthome_mock_ai.persistence import BaseRepository, DatabaseConnectionManager
+from smarthome_mock_ai.simulator import HomeSimulator
 
 
 class TestDeviceStateManager:
@@ -54,6 +56,27 @@ class TestDeviceStateManager:
         assert states["light1"]["state"]["is_on"] is True
         assert states["light1"]["state"]["brightness"] == 75
 
+    def test_save_states_skips_unchanged_states(self, temp_state_file, sample_devices, monkeypatch):
+        """Test that unchanged states are not rewritten and no temp file is left behind."""
+        replaced = []
+        real_replace = os.replace
+        monkeypatch.setattr(
+            "smarthome_mock_ai.device_persistence.os.replace",
+            lambda src, dst: (replaced.append(dst), real_replace(src, dst)),
+        )
+        manager = DeviceStateManager(temp_state_file)
+
+        assert manager.save_states(sample_devices) is True
+        assert manager.save_states(sample_devices) is True
+        assert replaced == [temp_state_file]
+
+        sample_devices["light1"].turn_off()
+        assert manager.save_states(sample_devices) is True
+        assert len(replaced) == 2
+        assert not os.path.exists(f"{temp_state_file}.tmp")
+        with open(temp_state_file) as f:
+            assert json.load(f)["light1"]["state"]["is_on"] is False
+
     def test_load_states_returns_none_if_file_not_exists(self, temp_state_file):
         """Test loading returns None when file doesn't exist."""
         manager = DeviceStateManager(temp_state_file)
@@ -92,6 +115,20 @@ class TestDeviceStateManager:
         assert sample_devices["light1"].get_status().state["brightness"] == 50
         assert sample_devices["light1"].get_status().state["is_on"] is True
 
+    def test_apply_states_to_device_subclass(self, temp_state_file):
+        """Test that device subclasses use their base class handler."""
+
+        class DimmableLight(Light):
+            pass
+
+        manager = DeviceStateManager(temp_state_file)
+        device = DimmableLight("light2", "Dimmable Light", "test_room")
+        states = {"light2": {"state": {"is_on": True, "brightness": 30}}}
+
+        assert manager.apply_states_to_devices({"light2": device}, states) == 1
+        assert device.get_status().state["brightness"] == 30
+        assert device.get_status().state["is_on"] is True
+
     def test_backup_states(self, temp_state_file, sample_devices):
         """Test creating a backup of state file."""
         manager = DeviceStateManager(temp_state_file)
@@ -109,6 +146,25 @@ class TestDeviceStateManager:
             original_data = json.load(f)
         assert backup_data == original_data
 
+    def test_bulk_action_saves_once(self, temp_state_file, sample_devices):
+        """Test that a bulk simulator action writes the state file only once."""
+        sim = HomeSimulator(persist_state=False)
+        for device in sample_devices.values():
+            sim.register_device(device)
+        sim.register_device(Light("light2", "Second Light", "test_room"))
+        sim.persist_state = True
+        sim.state_manager = DeviceStateManager(temp_state_file)
+
+        with patch.object(sim.state_manager, "save_states", return_value=True) as save:
+            sim.turn_off_all_lights()
+            assert save.call_count == 1
+
+            with sim.batch_saves():
+                sim.turn_on_light("light1")
+                sim.set_temperature("thermostat1", 22.0)
+                assert save.call_count == 1
+            assert save.call_count == 2
+
 
 class TestInteractionLogger:
     """Test InteractionLogger."""
@@ -220,6 +276,47 @@ class TestInteractionLogger:
         ):
             logger.record_feedback("test_action_001", 2)
 
+    def test_record_feedback_batch(self, logger):
+        """Test recording feedback for several interactions at once."""
+        logger.log_interaction("开灯", {"tool": "turn_on_light"}, action_id="b1")
+        logger.log_interaction("关灯", {"tool": "turn_off_light"}, action_id="b2")
+
+        updated = logger.record_feedback_batch([("b1", 1, None), ("b2", -1, "只关客厅灯")])
+        assert updated == 2
+
+        assert logger.get_interaction_by_action_id("b1")["user_feedback"] == 1
+        b2 = logger.get_interaction_by_action_id("b2")
+        assert b2["user_feedback"] == -1
+        assert b2["corrected_command"] == "只关客厅灯"
+
+    def test_record_feedback_batch_invalid_score(self, logger):
+        """Test that an invalid score rejects the whole batch."""
+        logger.log_interaction("开灯", {"tool": "turn_on_light"}, action_id="b1")
+
+        with pytest.raises(ValueError):
+            logger.record_feedback_batch([("b1", 1, None), ("b1", 0, None)])
+        assert logger.get_interaction_by_action_id("b1")["user_feedback"] is None
+
+    def test_get_feedback_count(self, logger, temp_db_file):
+        """Test that the feedback counter follows updates, re-feedback and deletes."""
+        logger.log_interaction("开灯", {"tool": "turn_on_light"}, action_id="c1")
+        logger.log_interaction("关灯", {"tool": "turn_off_light"}, action_id="c2")
+        assert logger.get_feedback_count() == 0
+
+        logger.record_feedback("c1", 1)
+        logger.record_feedback("c1", -1)
+        logger.record_feedback_batch([("c2", 1, None)])
+        assert logger.get_feedback_count() == 2
+
+        import sqlite3
+        with sqlite3.connect(temp_db_file) as conn:
+            conn.execute("DELETE FROM interaction_logs WHERE action_id = 'c1'")
+        assert logger.get_feedback_count() == 1
+
+        # A new logger on an existing database keeps the count
+        logger.close()
+        assert InteractionLogger(temp_db_file).get_feedback_count() == 1
+
     def test_get_interaction_by_action_id(self, logger):
         """Test retrieving interaction by action_id."""
         logger.log_interaction(
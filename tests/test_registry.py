@@ -100,6 +100,18 @@ class TestDeviceRegistry:
         assert "therm1" in therms
         assert len(fans) == 0
 
+    def test_group_devices_by_type(self, empty_simulator):
+        """Test grouping is cached until the device set changes."""
+        empty_simulator.register_device(Light(device_id="light1", name="L1", room="r1"))
+        empty_simulator.register_device(Thermostat(device_id="therm1", name="T1", room="r1"))
+
+        grouped = empty_simulator.group_devices_by_type()
+        assert grouped == {"light": ["light1"], "thermostat": ["therm1"]}
+        assert empty_simulator.group_devices_by_type() is grouped
+
+        empty_simulator.unregister_device("therm1")
+        assert empty_simulator.group_devices_by_type() == {"light": ["light1"]}
+
     def test_list_devices_by_location(self, empty_simulator):
         """Test listing devices by location."""
         empty_simulator.register_device(Light(device_id="light1", name="L1", room="living_room"))
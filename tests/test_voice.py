@@ -173,6 +173,31 @@ class TestVoiceListenerTranscribe:
                 with pytest.raises(RuntimeError, match="Transcription API error"):
                     await listener.transcribe(str(wav_path))
 
+    @pytest.mark.asyncio
+    async def test_transcribe_reuses_client(self, tmp_path):
+        """Test repeated transcriptions share one HTTP client until closed."""
+        wav_path = tmp_path / "test.wav"
+        wav_path.write_bytes(b"RIFF")
+
+        mock_response = MagicMock()
+        mock_response.json.return_value = {"text": "打开客厅灯"}
+
+        with patch.dict(os.environ, {"OPENAI_API_KEY": "test-key"}):
+            listener = VoiceListener()
+            with patch(
+                "httpx.AsyncClient.post", new_callable=AsyncMock, return_value=mock_response
+            ):
+                await listener.transcribe(str(wav_path))
+                client = listener._client
+                await listener.transcribe(str(wav_path))
+
+            assert client is not None
+            assert listener._client is client
+
+            await listener.aclose()
+            assert client.is_closed
+            assert listener._client is None
+
 
 class TestVoiceListenerListen:
     """Test VoiceListener.listen method."""